@@ -0,0 +1,517 @@
+"""
+Benchmarks today.py against a local stand-in for GitHub's GraphQL API, so it can be measured without
+spending rate limit or depending on the network
+
+    python benchmark.py                                    # cold, warm and incremental runs of a synthetic user
+    python benchmark.py --repos 300 --depth 2000 --latency 50 --fail-502 0.02 --fail-403 0.01
+    python benchmark.py --json bench.json                  # save the results...
+    python benchmark.py --baseline bench.json              # ...and fail if a later run regresses against them
+    python benchmark.py --git                              # also check LOC_ENGINE=git against fixture repositories
+    python benchmark.py --serve 8000                       # only run the stand-in, for trying today.py itself:
+    GITHUB_GRAPHQL_URL=http://127.0.0.1:8000/graphql USER_NAME=bench ACCESS_TOKEN=test python today.py
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import today
+
+BENCH_USER = 'bench'
+BENCH_USER_ID = 'U_bench'
+BENCH_ORG = 'bench-org'
+AFFILIATIONS = ['OWNER', 'COLLABORATOR', 'ORGANIZATION_MEMBER']  # As queried by profile_card
+TEMPLATES = ('dark_mode.svg', 'light_mode.svg')
+SCENARIOS = ('cold', 'warm', 'incremental')
+METRICS = ('wall', 'requests', 'bytes', 'peak_memory')  # Compared against --baseline, lower is better
+# State of the stand-in, shared by its handler threads (see serve)
+SERVER = {'repos': {}, 'config': {}, 'stats': {}, 'rng': None, 'lock': threading.Lock()}
+
+def synthetic_user(repos, depth, seed, mine=0.7):
+    """
+    Returns the repositories of a synthetic user, {nameWithOwner: {'stars': n, 'commits': [...]}}, each
+    commit an (oid, author id, additions, deletions) tuple, newest first
+    Every tenth repository belongs to an organization, every 25th is empty, and the others are up to depth
+    commits deep (mostly shallow, as real accounts are), with `mine` of the commits authored by the user
+    """
+    rng = random.Random(seed)
+    data = {}
+    for index in range(repos):
+        owner = BENCH_ORG if index % 10 == 9 else BENCH_USER
+        name = f'{owner}/repo-{index}'
+        count = 0 if index % 25 == 24 else max(1, int(depth * rng.random() ** 2))
+        commits = [synthetic_commit(rng, name, number, mine) for number in range(count)]
+        data[name] = {'stars': rng.randrange(50), 'commits': commits[::-1]}
+    return data
+
+def synthetic_commit(rng, name, number, mine):
+    """
+    Returns the number-th commit of repository name; one in twenty has no GitHub user as its author
+    """
+    roll = rng.random()
+    author = BENCH_USER_ID if roll < mine else ('U_other' if roll < 0.95 else None)
+    return hashlib.sha1(f'{name}:{number}'.encode('utf-8')).hexdigest(), author, rng.randrange(500), rng.randrange(200)
+
+def expected_totals():
+    """
+    Returns what today.py should count for the synthetic user: [additions, deletions, my commits]
+    """
+    totals = [0, 0, 0]
+    for repository in SERVER['repos'].values():
+        for _, author, additions, deletions in repository['commits']:
+            if author == BENCH_USER_ID:
+                totals[0] += additions
+                totals[1] += deletions
+                totals[2] += 1
+    return totals
+
+def git_fixtures(directory, repos):
+    """
+    Writes the synthetic repositories (see synthetic_user) as bare git repositories under directory/<owner>/<name>.git,
+    for today.py's git engine to fetch, with one git commit per synthetic commit adding and deleting exactly its lines,
+    authored with the user's noreply address if the user made it
+    The lines a commit deletes are a file of their own, laid down by a first commit from someone else, so no blob
+    grows with the history and nothing counted as the user's depends on how git diffs a long file
+    """
+    for name, repository in repos.items():
+        commits = repository['commits'][::-1]  # Oldest first
+        if not commits:  # Listed without a head, today.py never fetches it
+            continue
+        path = os.path.join(directory, name + '.git')
+        subprocess.run(['git', 'init', '--quiet', '--bare', '--initial-branch=main', path], check=True)
+        stream = [git_fixture_commit('someone@example.com', 'seed',
+                                     [('del/' + oid, [f'{oid} -{line}' for line in range(deletions)])
+                                      for oid, _, _, deletions in commits if deletions])]
+        for oid, author, additions, deletions in commits:
+            email = f'{BENCH_USER}@users.noreply.github.com' if author == BENCH_USER_ID else 'other@example.com'
+            changes = [('del/' + oid, None)] if deletions else []
+            if additions:
+                changes.append(('add/' + oid, [f'{oid} +{line}' for line in range(additions)]))
+            stream.append(git_fixture_commit(email, oid, changes))
+        subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=b''.join(stream), check=True)
+
+def git_fixture_commit(email, message, changes):
+    """
+    Returns one commit on main in git fast-import format, changes being (path, lines) pairs, lines None to delete it
+    """
+    def data(text):
+        return b'data %d\n' % len(text.encode('utf-8')) + text.encode('utf-8') + b'\n'
+    parts = [f'commit refs/heads/main\nauthor n <{email}> 1700000000 +0000\ncommitter n <{email}> 1700000000 +0000\n'.encode('utf-8'),
+             data(message)]
+    for path, lines in changes:
+        if lines is None:
+            parts.append(f'D {path}\n'.encode('utf-8'))
+        else:
+            parts.append(f'M 644 inline {path}\n'.encode('utf-8') + data(''.join(line + '\n' for line in lines)))
+    return b''.join(parts)
+
+def rate_limit():
+    """
+    Returns the rateLimit field of a response; every query costs 1 point of an hourly budget
+    """
+    with SERVER['lock']:
+        SERVER['stats']['remaining'] -= 1
+        remaining = SERVER['stats']['remaining']
+    reset_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 3600))
+    return {'cost': 1, 'remaining': remaining, 'limit': SERVER['config']['limit'], 'resetAt': reset_at}
+
+def repository_history(query, name, cursor=None, author_id=None):
+    """
+    Returns a repository with one page (100 commits after cursor) of its default branch history, only
+    the commits of author_id if given, with only the commit fields asked for in query,
+    or None for an unknown repository
+    """
+    repository = SERVER['repos'].get(name)
+    if repository is None:
+        return None
+    commits = repository['commits']
+    if not commits:
+        return {'defaultBranchRef': None}
+    if author_id is not None:
+        commits = [commit for commit in commits if commit[1] == author_id]
+    start = int(cursor or 0)
+    edges = []
+    for oid, author, additions, deletions in commits[start:start + 100]:
+        node = {'oid': oid, 'additions': additions, 'deletions': deletions}
+        if 'committedDate' in query:
+            node['committedDate'] = '2024-01-01T00:00:00Z'
+        if 'author {' in query:
+            node['author'] = {'user': {'id': author} if author else None}
+        edges.append({'node': node})
+    end = start + len(edges)
+    history = {'totalCount': len(commits), 'edges': edges, 'pageInfo': {'endCursor': str(end), 'hasNextPage': end < len(commits)}}
+    return {'defaultBranchRef': {'target': {'history': history}}}
+
+def repository_node(name):
+    """
+    Returns a repository as listed by today.repository_pages and today.repository_getter, or None if it is unknown
+    """
+    if name not in SERVER['repos']:
+        return None
+    commits = SERVER['repos'][name]['commits']
+    branch = {'target': {'oid': commits[0][0], 'history': {'totalCount': len(commits)}}} if commits else None
+    return {'nameWithOwner': name, 'owner': {'login': name.split('/')[0]},
+            'stargazers': {'totalCount': SERVER['repos'][name]['stars']}, 'defaultBranchRef': branch}
+
+def repository_listing(variables):
+    """
+    Returns a page of the user's repositories connection, as listed by today.repository_pages
+    """
+    affiliations = variables.get('owner_affiliation') or ['OWNER']
+    names = [name for name in SERVER['repos']
+             if ('OWNER' in affiliations if name.startswith(BENCH_USER + '/') else len(affiliations) > 1)]
+    start, size = int(variables.get('cursor') or 0), variables['page_size']
+    edges = [{'node': repository_node(name)} for name in names[start:start + size]]
+    end = start + len(edges)
+    return {'totalCount': len(names), 'edges': edges, 'pageInfo': {'endCursor': str(end), 'hasNextPage': end < len(names)}}
+
+def profile():
+    """
+    Returns the user, as asked for by today.profile_getter
+    """
+    owned = sum(1 for name in SERVER['repos'] if name.startswith(BENCH_USER + '/'))
+    return {'id': BENCH_USER_ID, 'createdAt': '2015-03-04T00:00:00Z', 'followers': {'totalCount': 42},
+            'repositories': {'totalCount': owned}, 'contributed': {'totalCount': len(SERVER['repos'])}}
+
+def contributions(day):
+    """
+    Returns the made-up but stable number of contributions of the synthetic user on day
+    """
+    return hashlib.sha1(day.isoformat().encode('utf-8')).digest()[0] % 4
+
+def contribution_calendar(start_date, end_date):
+    """
+    Returns the contribution calendar from start_date to end_date, in whole weeks as GitHub does
+    """
+    day = datetime.date.fromisoformat(start_date[:10])
+    day, end = day - datetime.timedelta(days=(day.weekday() + 1) % 7), datetime.date.fromisoformat(end_date[:10])
+    weeks = []
+    while day <= end:
+        week = [day + datetime.timedelta(days=offset) for offset in range(7)]
+        weeks.append({'contributionDays': [{'date': date.isoformat(), 'contributionCount': contributions(date)} for date in week]})
+        day += datetime.timedelta(days=7)
+    return {'contributionCalendar': {'weeks': weeks}}
+
+def contribution_total(start_date, end_date):
+    """
+    Returns the contributionsCollection from start_date to end_date with only its total
+    """
+    day, end = datetime.date.fromisoformat(start_date[:10]), datetime.date.fromisoformat(end_date[:10])
+    total = 0
+    while day <= end:
+        total += contributions(day)
+        day += datetime.timedelta(days=1)
+    return {'contributionCalendar': {'totalContributions': total}}
+
+def graphql_response(request):
+    """
+    Answers one GraphQL request the way GitHub would, after the configured latency, failing it with
+    a 502 or a secondary rate limit 403 as often as configured
+    Returns (status, headers, body)
+    """
+    config, rng = SERVER['config'], SERVER['rng']
+    time.sleep(config['latency'] * rng.uniform(0.5, 1.5) / 1000)
+    roll = rng.random()
+    if roll < config['fail_502']:
+        return 502, {}, b'{"message": "Server Error"}'
+    if roll < config['fail_502'] + config['fail_403']:
+        return 403, {'Retry-After': str(config['retry_after'])}, b'{"message": "You have exceeded a secondary rate limit."}'
+    query, variables = request['query'], request.get('variables') or {}
+    if 'fragment historyPage' in query:
+        data, index = {}, 0
+        while 'owner' + str(index) in variables:
+            name = variables['owner' + str(index)] + '/' + variables['name' + str(index)]
+            data['r' + str(index)] = repository_history(query, name, None, variables.get('author_id'))
+            index += 1
+    elif 'repository(name: $repo_name' in query:
+        name = variables['owner'] + '/' + variables['repo_name']
+        data = {'repository': repository_history(query, name, variables.get('cursor'), variables.get('author_id'))}
+    elif 'repository(owner: $owner, name: $repo_name)' in query:  # today.repository_getter
+        data = {'repository': repository_node(variables['owner'] + '/' + variables['repo_name'])}
+    elif 'window: contributionsCollection' in query:  # today.contribution_years
+        user = {'window': contribution_calendar(variables['from'], variables['to'])}
+        for name in variables:
+            if name.startswith('from') and name[4:].isdigit():
+                user['y' + name[4:]] = contribution_total(variables[name], variables['to' + name[4:]])
+        data = {'user': user}
+    elif 'contributed:' in query:
+        data = {'user': profile()}
+    elif 'repositories(first: $page_size' in query:
+        data = {'user': {'repositories': repository_listing(variables)}}
+    else:
+        return 200, {}, json.dumps({'data': None, 'errors': [{'message': 'Unsupported query'}]}).encode('utf-8')
+    data['rateLimit'] = rate_limit()
+    return 200, {}, json.dumps({'data': data}).encode('utf-8')
+
+def push_commits(repos, commits):
+    """
+    Adds commits new commits to the first repos non-empty repositories, as if they had been pushed to
+    """
+    rng = SERVER['rng']
+    with SERVER['lock']:
+        for name in [name for name, repository in SERVER['repos'].items() if repository['commits']][:repos]:
+            history = SERVER['repos'][name]['commits']
+            new = [synthetic_commit(rng, name, len(history) + number, 0.7) for number in range(commits)]
+            SERVER['repos'][name]['commits'] = new[::-1] + history
+
+def reset_stats():
+    """
+    Zeroes the traffic counters and restores the rate limit budget
+    """
+    with SERVER['lock']:
+        SERVER['stats'] = {'requests': 0, 'bytes': 0, 'failures': 0, 'remaining': SERVER['config']['limit']}
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    """
+    POST /graphql is the API; POST /reset, POST /push and GET /stats control the stand-in and are not counted
+    """
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as with GitHub
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/graphql':
+            status, headers, payload = graphql_response(json.loads(body))
+            with SERVER['lock']:
+                SERVER['stats']['requests'] += 1
+                SERVER['stats']['bytes'] += len(body) + len(payload)
+                SERVER['stats']['failures'] += status != 200
+        elif self.path == '/push':
+            request = json.loads(body)
+            push_commits(request['repos'], request['commits'])
+            status, headers, payload = 200, {}, b'{}'
+        elif self.path == '/reset':
+            reset_stats()
+            status, headers, payload = 200, {}, b'{}'
+        else:
+            status, headers, payload = 404, {}, b'{}'
+        self.reply(status, headers, payload)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self.reply(404, {}, b'{}')
+        with SERVER['lock']:
+            stats = dict(SERVER['stats'], expected=expected_totals())
+        self.reply(200, {}, json.dumps(stats).encode('utf-8'))
+
+    def reply(self, status, headers, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(config, port=0, ready=None):
+    """
+    Runs the stand-in for the synthetic user described by config until the process is stopped
+    The port it listens on is put on the ready queue, if given
+    """
+    SERVER['config'] = config
+    SERVER['rng'] = random.Random(config['seed'])
+    SERVER['repos'] = synthetic_user(config['repos'], config['depth'], config['seed'])
+    reset_stats()
+    server = ThreadingHTTPServer(('127.0.0.1', port), GraphQLHandler)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+def stand_in(config):
+    """
+    Starts the stand-in in a process of its own, so its work counts towards neither the time nor the memory
+    of the client being measured
+    Returns (process, base URL)
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(config, 0, ready), daemon=True)
+    process.start()
+    return process, 'http://127.0.0.1:{}'.format(ready.get(timeout=30))
+
+def control(url, path, payload=None):
+    """
+    Calls one of the stand-in's control endpoints, returning its JSON answer
+    """
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    with urllib.request.urlopen(urllib.request.Request(url + path, data=data, method='GET' if data is None else 'POST')) as response:
+        return json.loads(response.read())
+
+def client_reset():
+    """
+    Puts today.py's module state back to what a fresh process starts with (the cache on disk is kept)
+    """
+    today.use_profile(BENCH_USER)
+    today.SESSION['session'] = None
+    today.CACHES.clear()
+    today.SVG_TEMPLATES.clear()
+    today.RATE_LIMIT_COST.clear()
+    today.RATE_LIMIT.update(tokens=float(today.RATE_LIMIT_BURST), updated=time.monotonic(), until=0.0,
+                            remaining=None, reset_at=0.0)
+
+def run_scenario(url, filenames):
+    """
+    Renders the synthetic user's cards end to end, through profile_getter, loc_query, cache_builder
+    (and recursive_loc), commit_counter and svg_overwrite, the same steps as profile_card minus its fast path
+    Returns the measurements of the run
+    """
+    client_reset()
+    control(url, '/reset', {})
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    profile = today.profile_getter(today.USER_NAME)
+    today.OWNER_ID = profile.id
+    repos, stars = today.loc_query(AFFILIATIONS)
+    total_loc = today.cache_builder(repos, 7, False)
+    commit_data = today.commit_counter(7)
+    today.svg_render(filenames, profile._replace(stars=stars), today.daily_readme(profile.created_at), commit_data, total_loc)
+    wall = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    stats = control(url, '/stats')
+    return {'wall': wall, 'requests': stats['requests'], 'bytes': stats['bytes'], 'peak_memory': peak_memory,
+            'failures': stats['failures'], 'retries': sum(today.RETRY_COUNT.values()),
+            'correct': total_loc[:2] + [commit_data] == stats['expected']}
+
+def benchmark(config, push_repos, push_commits):
+    """
+    Runs every scenario against a fresh stand-in, in a scratch directory so the real cache is not touched:
+    cold (no cache), warm (nothing changed since) and incremental (commits pushed to push_repos repositories)
+    Returns {scenario: measurements}
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    process, url = stand_in(config)
+    workdir = tempfile.mkdtemp(prefix='today-benchmark-')
+    cwd = os.getcwd()
+    today.GRAPHQL_URL = url + '/graphql'
+    today.RATE_LIMIT_PER_MINUTE = config['rate_limit_per_minute']
+    results = {}
+    try:
+        os.chdir(workdir)
+        today.ensure_cache_directory()
+        filenames = []
+        for template in TEMPLATES:
+            shutil.copyfile(os.path.join(here, template), template)
+            filenames.append(template)
+        tracemalloc.start()
+        for scenario in SCENARIOS:
+            if scenario == 'incremental':
+                control(url, '/push', {'repos': push_repos, 'commits': push_commits})
+            results[scenario] = run_scenario(url, filenames)
+        tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        process.terminate()
+    return results
+
+def git_benchmark(config):
+    """
+    Counts the synthetic user cold with the GraphQL engine, then with LOC_ENGINE=git against fixture repositories
+    holding the same commits (see git_fixtures), in scratch directories; both must come to the stand-in's totals
+    Returns {engine: measurements}
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    process, url = stand_in(config)
+    workdir = tempfile.mkdtemp(prefix='today-benchmark-git-')
+    cwd = os.getcwd()
+    engine, remote, clones = today.LOC_ENGINE, today.GIT_REMOTE, today.GIT_CLONE_DIR
+    today.GRAPHQL_URL = url + '/graphql'
+    today.RATE_LIMIT_PER_MINUTE = config['rate_limit_per_minute']
+    results = {}
+    try:
+        git_fixtures(os.path.join(workdir, 'remote'), synthetic_user(config['repos'], config['depth'], config['seed']))
+        today.GIT_REMOTE = 'file://' + os.path.join(workdir, 'remote', '{}.git')
+        today.GIT_CLONE_DIR = os.path.join(workdir, 'clones')
+        tracemalloc.start()
+        for today.LOC_ENGINE in ('graphql', 'git'):
+            os.chdir(workdir)
+            os.makedirs(today.LOC_ENGINE, exist_ok=True)
+            os.chdir(today.LOC_ENGINE)
+            today.ensure_cache_directory()
+            for template in TEMPLATES:
+                shutil.copyfile(os.path.join(here, template), template)
+            results[today.LOC_ENGINE] = run_scenario(url, list(TEMPLATES))
+        tracemalloc.stop()
+    finally:
+        today.LOC_ENGINE, today.GIT_REMOTE, today.GIT_CLONE_DIR = engine, remote, clones
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        process.terminate()
+    return results
+
+def report(results, baseline=None, tolerance=0.2):
+    """
+    Prints the results, and how they compare to baseline (results of an earlier run) if given
+    Returns the (scenario, metric) pairs that are more than tolerance worse than the baseline
+    """
+    regressions = []
+    print('{:<12}{:>12}{:>10}{:>12}{:>14}{:>9}{:>10}'.format('scenario', 'wall', 'requests', 'bytes', 'peak memory', 'retries', 'correct'))
+    for scenario, result in results.items():
+        print('{:<12}{:>12}{:>10,}{:>12}{:>14}{:>9,}{:>10}'.format(
+            scenario, '%.4f s' % result['wall'], result['requests'], '%.1f kB' % (result['bytes'] / 1000),
+            '%.1f kB' % (result['peak_memory'] / 1000), result['retries'], 'yes' if result['correct'] else 'NO'))
+        for metric in METRICS:
+            before = (baseline or {}).get(scenario, {}).get(metric)
+            if before and result[metric] > before * (1 + tolerance):
+                print('   {} regressed: {:,.4g} -> {:,.4g} ({:+.0%})'.format(metric, before, result[metric], result[metric] / before - 1))
+                regressions.append((scenario, metric))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks today.py against a local GitHub GraphQL stand-in')
+    parser.add_argument('--repos', type=int, default=120, help='repositories of the synthetic user (default: 120)')
+    parser.add_argument('--depth', type=int, default=800, help='commits in the deepest history (default: 800)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic user and of the injected failures')
+    parser.add_argument('--latency', type=float, default=0, help='mean latency of each request, in ms (default: 0)')
+    parser.add_argument('--fail-502', type=float, default=0, help='share of requests answered with a 502')
+    parser.add_argument('--fail-403', type=float, default=0, help='share of requests answered with a secondary rate limit 403')
+    parser.add_argument('--retry-after', type=float, default=0, help='Retry-After of those 403s, in seconds (default: 0)')
+    parser.add_argument('--limit', type=int, default=5000, help='hourly rate limit budget of the stand-in (default: 5000)')
+    parser.add_argument('--rate-limit-per-minute', type=int, default=10 ** 6,
+                        help="today.py's request pacing (default: 1000000, effectively off)")
+    parser.add_argument('--push-repos', type=int, default=10, help='repositories pushed to before the incremental run')
+    parser.add_argument('--push-commits', type=int, default=5, help='commits pushed to each of them')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with the results written by an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='how much worse than the baseline is a regression (default: 0.2)')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='only run the stand-in, on PORT')
+    parser.add_argument('--git', action='store_true', help='also count the user with LOC_ENGINE=git, against fixture repositories')
+    args = parser.parse_args(argv)
+    config = {'repos': args.repos, 'depth': args.depth, 'seed': args.seed, 'latency': args.latency,
+              'fail_502': args.fail_502, 'fail_403': args.fail_403, 'retry_after': args.retry_after,
+              'limit': args.limit, 'rate_limit_per_minute': args.rate_limit_per_minute}
+
+    if args.serve is not None:
+        print(f'Serving {args.repos} repositories of {BENCH_USER} on http://127.0.0.1:{args.serve}/graphql')
+        serve(config, args.serve)
+        return
+
+    results = benchmark(config, args.push_repos, args.push_commits)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    if args.git:
+        results.update(git_benchmark(config))
+    regressions = report(results, baseline, args.tolerance)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions or not all(result['correct'] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,116 @@
-import datetime
-from dateutil import relativedelta
-import requests
+from datetime import datetime, timedelta, timezone
 import os
-from xml.dom import minidom
+import random
+import re
+from html import escape
 import time
 import hashlib
+import hmac
+import json
+import calendar
+import math
 import signal
-from typing import Dict, List, Optional, Tuple, Union
+import threading
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple, Union
 import sys
+import argparse
+import shutil
+if TYPE_CHECKING:  # For the annotations only, see below
+    import requests
+# requests, dateutil, sqlite3 and concurrent.futures are imported where they are used, so importing this module stays
+# cheap (--help, --startup-report, benchmark.py). Every run still loads requests and dateutil, for the profile and
+# repository listing queries and the age; a run that takes the fast path (see fast_path_state) only skips reading the
+# cache (and sqlite3), and concurrent.futures is only loaded when a repository changed.
+# Check with: python today.py --startup-report
 
 # Personal access token with permissions: read:enterprise, read:org, read:repo_hook, read:user, repo
-HEADERS = {'Authorization': 'token ' + os.environ['ACCESS_TOKEN']}
-USER_NAME = os.environ['USER_NAME']
-QUERY_COUNT = {'user_getter': 0, 'follower_getter': 0, 'graph_repos_stars': 0, 'recursive_loc': 0, 'graph_commits': 0, 'loc_query': 0}
-# OWNER_ID = os.environ['OWNER_ID']
+# Both are read without failing, so the module can be imported without them; main() validates them before any query
+HEADERS = {'Authorization': 'token ' + os.environ.get('ACCESS_TOKEN', '')}
+USER_NAME = os.environ.get('USER_NAME', '')  # The user being rendered, swapped by use_profile in batch mode
+QUERY_COUNT = {'recursive_loc': 0, 'loc_query': 0, 'loc_batch_query': 0, 'profile_getter': 0, 'contribution_years': 0, 'repository_getter': 0}
+QUERY_COUNT_LOCK = threading.Lock()
+# Number of repositories crawled at once by loc_crawler. GitHub asks for no more than 100 concurrent requests,
+# but the secondary rate limit kicks in well before that, so keep this small.
+LOC_WORKERS = int(os.environ.get('LOC_WORKERS', '4'))
+# Token bucket shared by every query function (see wait_for_rate_limit). 'tokens' paces requests under the secondary
+# rate limit, 'remaining'/'reset_at'/'limit' track the primary (hourly) budget reported by each query's rateLimit field,
+# and 'until' is set when GitHub tells us to back off, so one secondary rate limit pauses the whole crawl
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', '1000'))
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_RESERVE = 50  # Primary points never spent, so a run never leaves the token unusable
+RATE_LIMIT = {'tokens': float(RATE_LIMIT_BURST), 'updated': time.monotonic(), 'until': 0.0,
+              'remaining': None, 'limit': 5000, 'reset_at': 0.0}
+RATE_LIMIT_COST = {}  # funct_id -> [total cost, queries], for estimating what pending queries will cost
+RATE_LIMIT_LOCK = threading.Lock()
+# Asked for by every query alongside its data, and fed to rate_limit_update by graphql_post
+RATE_LIMIT_FIELD = """
+        rateLimit {
+            cost
+            remaining
+            limit
+            resetAt
+        }"""
+# loc_batch_query packs the first history page of this many repositories into one request, then grows or shrinks
+# the batch so that GitHub answers it in about LOC_BATCH_TARGET_SECONDS, well within the 10 s it allows a query
+# (its rateLimit cost does not help here: up to 50 aliased history(first: 100) connections all cost 1 point)
+LOC_BATCH_SIZE = int(os.environ.get('LOC_BATCH_SIZE', '10'))
+LOC_BATCH_MAX_SIZE = 50
+LOC_BATCH_TARGET_SECONDS = 4.0
+# Every query goes through one pooled, keep-alive session (see graphql_post). HTTP_POOL_SIZE should be at least
+# LOC_WORKERS, otherwise workers wait on each other for a connection.
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+GRAPHQL_URL = os.environ.get('GITHUB_GRAPHQL_URL', 'https://api.github.com/graphql')  # benchmark.py points it at its stand-in
+HTTP_RETRIES = 5
+HTTP_TIMEOUT = 30
+SESSION = {'session': None}
+SESSION_LOCK = threading.Lock()
+# Retries and the seconds spent backing off before them, per function, kept alongside QUERY_COUNT
+RETRY_COUNT = {funct_id: 0 for funct_id in QUERY_COUNT}
+RETRY_TIME = {funct_id: 0.0 for funct_id in QUERY_COUNT}
+# How cache_builder counts the commits of a repository that changed: 'graphql' pages its history through the API
+# (see loc_crawler), 'git' fetches it into a bare clone under GIT_CLONE_DIR, kept between runs so only new objects are
+# fetched, and reads it locally with git log (see git_crawler). GIT_REMOTE is where the clones come from, {} standing
+# for owner/name, e.g. file:///srv/fixtures/{}.git. My commits are the ones authored with one of my GitHub noreply
+# addresses or one of GIT_AUTHOR_EMAILS (comma separated), which the git engine requires (see validate_environment).
+# Switching engines counts every repository again with the new one (see loc_stats), so totals never mix the two
+LOC_ENGINE = os.environ.get('LOC_ENGINE', 'graphql')
+GIT_CLONE_DIR = os.environ.get('GIT_CLONE_DIR', 'cache/clones')
+GIT_REMOTE = os.environ.get('GIT_REMOTE', 'https://github.com/{}.git')
+GIT_AUTHOR_EMAILS = [email.strip() for email in os.environ.get('GIT_AUTHOR_EMAILS', '').split(',') if email.strip()]
+GIT_HEAD_REF = 'refs/loc/head'  # Where each clone keeps the default branch it was last fetched at
+# Where cache_builder keeps its per-repository records: 'text' (the git-committed cache/<sha256(user)>.txt files)
+# or 'sqlite' (one indexed database at CACHE_DB, shared by every user)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'text')
+CACHE_DB = os.environ.get('CACHE_DB', 'cache/cache.sqlite3')
+# Compiled SVG templates, filename -> ((mtime_ns, size), chunks, slots, current bytes), see svg_compile.
+# A slot is the text of any <tspan> or <text> with an id attribute, e.g. <tspan id="repo_data">84</tspan>
+SVG_TEMPLATES = {}
+SVG_SLOT = re.compile(rb'(<(?:tspan|text)\b[^>]*?\bid="([^"]+)"[^>]*>)([^<]*)(</)')
+# Append-only journal next to the cache file, one fsync'd JSON line per finished page or repository (see journal_append)
+JOURNAL = {'fd': None}
+JOURNAL_LOCK = threading.Lock()
+CRAWL_STOP = threading.Event()  # Set while a failed or interrupted LOC crawl stops its workers (see crawl_stop)
+OWNER_ID = None  # The GraphQL node id of USER_NAME, set by main() from profile_getter
+# Per user state kept between runs (see state_load): the fingerprint of the repository heads the cache was last built
+# from with the totals it gave (see fast_path_state), the contributions of every past year and of every day of this one
+# (see contributions_delta),
+# and when each metric was last recomputed from scratch, which happens every RECONCILE_DAYS (0 for never)
+STATE_FILE = 'cache/{}.state'
+RECONCILE_DAYS = float(os.environ.get('RECONCILE_DAYS', '30'))
+CONTRIBUTIONS_WINDOW_DAYS = 7  # Days before the last run fetched again, as GitHub may still be counting them
+# Spans of every GraphQL request (see trace_span), recorded when TRACE_FILE (or --trace) names a file to write them to:
+# Chrome trace format (chrome://tracing, Perfetto) if it ends in .json, otherwise one JSON line per span
+TRACE = {'file': os.environ.get('TRACE_FILE'), 'spans': [], 'start': time.perf_counter()}
+TRACE_LOCK = threading.Lock()
+# Serve mode (see serve_cards): what the last refresh rendered, kept in memory, and the repositories that webhooks
+# asked to refresh since. The refresh interval is jittered by SERVE_JITTER either way, so many daemons do not line up
+SERVE_INTERVAL = float(os.environ.get('SERVE_INTERVAL', '3600'))
+SERVE_JITTER = 0.1
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')  # Checked against X-Hub-Signature-256, webhooks are refused without it
+DAEMON = {'svgs': {}, 'profile': None, 'repos': None, 'birthday': None, 'pending': set(), 'full': False,
+          'wake': threading.Event(), 'lock': threading.Lock()}
+CACHES = {}  # (CACHE_BACKEND, user, comment_size) -> the cache, so its records stay in memory between uses
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', '50'))  # Import time allowed by --startup-report
 
 def validate_date(date_str: str) -> bool:
     """Validates if a string is a proper ISO format date."""
@@ -55,12 +152,14 @@ def validate_github_username(username: str) -> bool:
         return False
     return all(c.isalnum() or c == '-' for c in username)
 
-def validate_environment() -> None:
-    """Validates all required environment variables are present and valid."""
+def validate_environment(batch: bool = False) -> None:
+    """Validates all required environment variables are present and valid (USER_NAME is not needed in batch mode)."""
     required_vars = {
         'ACCESS_TOKEN': validate_github_token,
         'USER_NAME': validate_github_username
     }
+    if batch:
+        del required_vars['USER_NAME']
     
     # Debug logging
     for var in required_vars:
@@ -86,6 +185,13 @@ def validate_environment() -> None:
             error_msg.append(f"Invalid variables: {', '.join(invalid)}")
         raise EnvironmentError(' | '.join(error_msg))
 
+    # The git engine tells my commits apart by their author email alone. Most are not made with the noreply address,
+    # so without the emails I commit with it would quietly count next to nothing, and they are one user's emails
+    if LOC_ENGINE == 'git' and batch:
+        raise EnvironmentError("LOC_ENGINE=git cannot be used in batch mode, GIT_AUTHOR_EMAILS belong to one user")
+    if LOC_ENGINE == 'git' and not GIT_AUTHOR_EMAILS:
+        raise EnvironmentError("LOC_ENGINE=git needs GIT_AUTHOR_EMAILS, the comma separated emails you commit with")
+
 def ensure_cache_directory():
     if not os.path.exists('cache'):
         os.makedirs('cache')
@@ -96,8 +202,9 @@ def daily_readme(birthday: str) -> str:
         raise ValueError("Birthday must be in ISO format (YYYY-MM-DD)")
     
     try:
+        from dateutil import relativedelta
         birth_date = datetime.fromisoformat(birthday.replace('Z', '+00:00'))
-        diff = relativedelta.relativedelta(datetime.today(), birth_date)
+        diff = relativedelta.relativedelta(datetime.now(birth_date.tzinfo), birth_date)
         return '{} {}, {} {}, {} {}{}'.format(
             diff.years, 'year' + format_plural(diff.years),
             diff.months, 'month' + format_plural(diff.months),
@@ -117,8 +224,153 @@ def format_plural(unit):
     """
     return 's' if unit != 1 else ''
 
-def simple_request(func_name: str, query: str, variables: Dict) -> requests.Response:
-    """Makes a GitHub GraphQL API request with validation."""
+def http_session() -> 'requests.Session':
+    """
+    Returns the session shared by every query, creating it on first use
+    """
+    import requests
+    with SESSION_LOCK:
+        if SESSION['session'] is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(HEADERS)
+            session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+            SESSION['session'] = session
+        return SESSION['session']
+
+def graphql_post(func_name: str, query: str, variables: Dict, timeout: float = HTTP_TIMEOUT, page: Optional[int] = None,
+                 retry_timeouts: bool = True) -> Tuple['requests.Response', Optional[Dict]]:
+    """
+    Posts a GraphQL query through the shared session
+    Retries connection errors, 502/503/504 and secondary rate limits with jittered exponential backoff
+    (or as long as Retry-After asks), and returns the last response whatever its status,
+    along with its JSON body parsed once (None unless the status is 200)
+    page is the number of the page being fetched, when paginating, for the trace
+    If retry_timeouts is False, a 502 or 504 (GitHub timing out on the query) is returned at once instead
+    """
+    import requests
+    start, waited = time.perf_counter(), 0.0
+    for attempt in range(HTTP_RETRIES + 1):
+        before = time.perf_counter()
+        wait_for_rate_limit(func_name)
+        waited += time.perf_counter() - before
+        try:
+            request = http_session().post(GRAPHQL_URL, json={'query': query, 'variables': variables}, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == HTTP_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            delay = retry_delay(request, attempt)
+            if delay is None or attempt == HTTP_RETRIES or (not retry_timeouts and request.status_code in (502, 504)):
+                body = None
+                if request.status_code == 200:
+                    body = request.json()
+                    rate_limit_update(func_name, (body.get('data') or {}).get('rateLimit'))
+                if TRACE['file']:
+                    trace_span(func_name, variables, page, start, waited, attempt, request, body)
+                return request, body
+        retry_count(func_name, delay)
+        CRAWL_STOP.wait(delay)  # Cut short if the crawl is stopping, wait_for_rate_limit then gives up
+        waited += delay
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    Returns a "full jitter" exponential backoff delay, a random time between 0 and base * 2^attempt seconds
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def retry_delay(request, attempt):
+    """
+    Returns how long to wait before retrying a response, or None if it should not be retried
+    A secondary rate limit also pauses every other worker for that long
+    """
+    retry_after = request.headers.get('Retry-After')
+    if request.status_code in (502, 503, 504):
+        return float(retry_after) if retry_after is not None else backoff_delay(attempt)
+    if request.status_code not in (403, 429):
+        return None
+    if request.headers.get('X-RateLimit-Remaining') == '0':  # The primary budget is spent, wait for it to reset
+        delay = float(request.headers.get('X-RateLimit-Reset', 0)) - time.time() + 1
+    elif retry_after is None and 'secondary rate limit' not in request.text.lower():
+        return None  # A real permissions problem, retrying will not help
+    else:
+        delay = float(retry_after) if retry_after is not None else 60 + backoff_delay(attempt, 60, 900)
+    with RATE_LIMIT_LOCK:
+        RATE_LIMIT['until'] = max(RATE_LIMIT['until'], time.time() + delay)
+    return delay
+
+def wait_for_rate_limit(funct_id=None):
+    """
+    Blocks the calling worker until the shared token bucket lets it send one more query:
+    no GitHub back-off pause in effect, a token available under RATE_LIMIT_PER_MINUTE, and enough
+    primary budget left (above RATE_LIMIT_RESERVE) for what this kind of query usually costs
+    Raises CrawlStopped instead if the LOC crawl is stopping, however long the wait would have been
+    """
+    cost = rate_limit_cost(funct_id)
+    while True:
+        if CRAWL_STOP.is_set():
+            raise CrawlStopped("The LOC crawl is stopping")
+        with RATE_LIMIT_LOCK:
+            now = time.monotonic()
+            RATE_LIMIT['tokens'] = min(RATE_LIMIT_BURST, RATE_LIMIT['tokens'] + (now - RATE_LIMIT['updated']) * RATE_LIMIT_PER_MINUTE / 60)
+            RATE_LIMIT['updated'] = now
+            wait = RATE_LIMIT['until'] - time.time()
+            if wait <= 0 and RATE_LIMIT['remaining'] is not None and RATE_LIMIT['remaining'] - cost < RATE_LIMIT_RESERVE:
+                wait = RATE_LIMIT['reset_at'] - time.time() + 1
+                if wait <= 0:  # The budget has reset since the last response told us otherwise
+                    RATE_LIMIT['remaining'] = None
+            if wait <= 0 and RATE_LIMIT['tokens'] < 1:
+                wait = (1 - RATE_LIMIT['tokens']) * 60 / RATE_LIMIT_PER_MINUTE
+            if wait <= 0:
+                RATE_LIMIT['tokens'] -= 1
+                if RATE_LIMIT['remaining'] is not None:
+                    RATE_LIMIT['remaining'] -= cost  # Reserve it until the response reports the real figure
+                return
+        CRAWL_STOP.wait(wait)
+
+def rate_limit_update(funct_id, rate_limit):
+    """
+    Records the rateLimit { cost remaining limit resetAt } field of a response in the shared token bucket
+    """
+    if not rate_limit:
+        return
+    reset_at = calendar.timegm(time.strptime(rate_limit['resetAt'], '%Y-%m-%dT%H:%M:%SZ'))
+    with RATE_LIMIT_LOCK:
+        if reset_at > RATE_LIMIT['reset_at'] or RATE_LIMIT['remaining'] is None or rate_limit['remaining'] < RATE_LIMIT['remaining']:
+            RATE_LIMIT['remaining'] = rate_limit['remaining']
+        RATE_LIMIT['reset_at'] = max(RATE_LIMIT['reset_at'], reset_at)
+        RATE_LIMIT['limit'] = rate_limit.get('limit', RATE_LIMIT['limit'])
+        total, queries = RATE_LIMIT_COST.get(funct_id, [0, 0])
+        RATE_LIMIT_COST[funct_id] = [total + rate_limit['cost'], queries + 1]
+
+def rate_limit_cost(funct_id):
+    """
+    Returns the average primary rate limit cost of the queries funct_id has made so far (1 if it has made none)
+    """
+    with RATE_LIMIT_LOCK:
+        total, queries = RATE_LIMIT_COST.get(funct_id, [0, 0])
+    return max(1.0, total / queries) if queries else 1.0
+
+def rate_limit_eta(pending):
+    """
+    Projects how many seconds it will take to send the pending queries, a dict of funct_id -> number of queries,
+    given the secondary pacing and, if their cost does not fit in the primary budget left, the hourly resets
+    """
+    points = sum(count * rate_limit_cost(funct_id) for funct_id, count in pending.items())
+    queries = sum(pending.values())
+    with RATE_LIMIT_LOCK:
+        pacing = max(0.0, queries - RATE_LIMIT['tokens']) * 60 / RATE_LIMIT_PER_MINUTE
+        remaining, limit, reset_at = RATE_LIMIT['remaining'], RATE_LIMIT['limit'], RATE_LIMIT['reset_at']
+    if remaining is None or points <= remaining - RATE_LIMIT_RESERVE:
+        return pacing
+    windows = math.ceil((points - max(0, remaining - RATE_LIMIT_RESERVE)) / (limit - RATE_LIMIT_RESERVE))
+    return max(pacing, reset_at - time.time() + (windows - 1) * 3600)
+
+def simple_request(func_name: str, query: str, variables: Dict, timeout: float = 10, page: Optional[int] = None) -> Dict:
+    """Makes a GitHub GraphQL API request with validation, and returns its data."""
     if not isinstance(query, str) or not query.strip():
         raise ValueError("Query must be a non-empty string")
     if not isinstance(variables, dict):
@@ -126,16 +378,14 @@ def simple_request(func_name: str, query: str, variables: Dict) -> requests.Resp
     if not isinstance(func_name, str) or not func_name.strip():
         raise ValueError("Function name must be a non-empty string")
     
+    import requests
     try:
-        request = requests.post(
-            'https://api.github.com/graphql',
-            json={'query': query, 'variables': variables},
-            headers=HEADERS,
-            timeout=10  # Add timeout
-        )
+        request, body = graphql_post(func_name, query, variables, timeout=timeout, page=page)
         
         if request.status_code == 200:
-            return request
+            if body.get('data') is None:
+                raise Exception(f"{func_name} failed: {body.get('errors')}")
+            return body['data']
         elif request.status_code == 401:
             raise ValueError("Invalid GitHub token")
         elif request.status_code == 403:
@@ -146,48 +396,118 @@ def simple_request(func_name: str, query: str, variables: Dict) -> requests.Resp
     except requests.RequestException as e:
         raise ConnectionError(f"Failed to connect to GitHub API: {str(e)}")
 
-def graph_commits(start_date: str, end_date: str) -> int:
-    """Fetches commit count with date validation."""
-    if not validate_date(start_date):
-        raise ValueError("start_date must be in ISO format (YYYY-MM-DD)")
-    if not validate_date(end_date):
-        raise ValueError("end_date must be in ISO format (YYYY-MM-DD)")
-    
-    if datetime.fromisoformat(start_date.replace('Z', '+00:00')) > datetime.fromisoformat(end_date.replace('Z', '+00:00')):
-        raise ValueError("start_date cannot be after end_date")
-
-    query_count('graph_commits')
+def contribution_years(years: Dict[int, Tuple[datetime, datetime]], window: Tuple[datetime, datetime]) -> Tuple[Dict[int, int], Dict[str, int]]:
+    """
+    Uses GraphQL aliases (y2015, y2016, ...) to fetch, in a single request, the total contributions of USER_NAME in each
+    of years, {year: (start, end)}, along with the contributions of every day in window, (start, end)
+    GitHub only accepts windows of up to a year, hence one aliased contributionsCollection per year
+    Returns ({year: total contributions}, {'YYYY-MM-DD': contributions})
+    """
+    query_count('contribution_years')
+    declarations, fields = ['$login: String!', '$from: DateTime!', '$to: DateTime!'], []
+    variables = {'login': USER_NAME, 'from': window[0].strftime('%Y-%m-%dT%H:%M:%SZ'), 'to': window[1].strftime('%Y-%m-%dT%H:%M:%SZ')}
+    for year, (start, end) in years.items():
+        declarations.append('$from{0}: DateTime!, $to{0}: DateTime!'.format(year))
+        fields.append('            y{0}: contributionsCollection(from: $from{0}, to: $to{0}) {{ ...yearTotal }}'.format(year))
+        variables['from' + str(year)] = start.strftime('%Y-%m-%dT%H:%M:%SZ')
+        variables['to' + str(year)] = end.strftime('%Y-%m-%dT%H:%M:%SZ')
     query = """
-    query ($start_date: DateTime!, $end_date: DateTime!, $login: String!) {
+    query (""" + ', '.join(declarations) + """) {""" + RATE_LIMIT_FIELD + """
         user(login: $login) {
-            contributionsCollection(from: $start_date, to: $end_date) {
+            window: contributionsCollection(from: $from, to: $to) {
                 contributionCalendar {
-                    totalContributions
+                    weeks {
+                        contributionDays {
+                            date
+                            contributionCount
+                        }
+                    }
                 }
             }
+""" + '\n'.join(fields) + """
+        }
+    }
+""" + ("""
+    fragment yearTotal on ContributionsCollection {
+        contributionCalendar {
+            totalContributions
         }
     }
+    """ if years else '')  # GitHub rejects a query with an unused fragment
+    user = simple_request(contribution_years.__name__, query, variables)['user']
+    totals = {year: int(user['y' + str(year)]['contributionCalendar']['totalContributions']) for year in years}
+    first, last = window[0].strftime('%Y-%m-%d'), window[1].strftime('%Y-%m-%d')
+    days = {day['date']: day['contributionCount']
+            for week in user['window']['contributionCalendar']['weeks']
+            for day in week['contributionDays'] if first <= day['date'] <= last}
+    return totals, days
+
+def contributions_delta(created_at: str, state: Dict) -> int:
+    """
+    Returns the contributions of USER_NAME since the account was created, in one request
+    The total of every past year is kept in state for good, once the year is over. Of this year, the count of every
+    day with contributions is kept, so a run only fetches the days since the previous run, plus the
+    CONTRIBUTIONS_WINDOW_DAYS before it in case GitHub was still counting them.
+    Every RECONCILE_DAYS the whole year is fetched again, to correct any drift
     """
-    variables = {'start_date': start_date, 'end_date': end_date, 'login': USER_NAME}
-    request = simple_request(graph_commits.__name__, query, variables)
-    return int(request.json()['data']['user']['contributionsCollection']['contributionCalendar']['totalContributions'])
+    record = state.setdefault('contributions', {})
+    now = datetime.now(timezone.utc)
+    created = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    past_years = record.get('years', {})  # JSON keys, so the years are strings
+    missing = {}
+    for year in range(created.year, now.year):
+        if str(year) not in past_years:
+            missing[year] = (max(created, datetime(year, 1, 1, tzinfo=timezone.utc)),
+                             datetime(year + 1, 1, 1, tzinfo=timezone.utc) - timedelta(seconds=1))
+    full = reconcile_due(state, 'contributions') or record.get('year') != now.year
+    start = max(created, datetime(now.year, 1, 1, tzinfo=timezone.utc))
+    if not full:
+        start = max(start, datetime.fromisoformat(record['since'].replace('Z', '+00:00')) - timedelta(days=CONTRIBUTIONS_WINDOW_DAYS))
+    totals, window = contribution_years(missing, (start, now))
+    past_years.update((str(year), total) for year, total in totals.items())
+    days = {} if full else record['days']
+    for day, count in window.items():
+        if count:
+            days[day] = count
+        else:
+            days.pop(day, None)
+    record.clear()
+    record.update(years=past_years, year=now.year, days=days, since=now.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    if full:
+        reconciled(state, 'contributions')
+    return sum(past_years.values()) + sum(days.values())
 
-def graph_repos_stars(count_type, owner_affiliation, cursor=None, add_loc=0, del_loc=0):
+def repository_pages(funct_id, owner_affiliation, page_size=60):
     """
-    Uses GitHub's GraphQL v4 API to return my total repository, star, or lines of code count.
+    Uses GitHub's GraphQL v4 API and cursor pagination to stream all the repositories I have access to
+    (with respect to owner_affiliation), yielding each page's repositories connection as soon as it arrives
+    Every page carries what both repository_stars and cache_builder need, so a single pass over it feeds both
+    Each query is counted under funct_id
     """
-    query_count('graph_repos_stars')
     query = """
-    query ($owner_affiliation: [RepositoryAffiliation], $login: String!, $cursor: String) {
+    query ($owner_affiliation: [RepositoryAffiliation], $login: String!, $cursor: String, $page_size: Int!) {""" + RATE_LIMIT_FIELD + """
         user(login: $login) {
-            repositories(first: 100, after: $cursor, ownerAffiliations: $owner_affiliation) {
+            repositories(first: $page_size, after: $cursor, ownerAffiliations: $owner_affiliation) {
                 totalCount
                 edges {
                     node {
                         nameWithOwner
+                        owner {
+                            login
+                        }
                         stargazers {
                             totalCount
                         }
+                        defaultBranchRef {
+                            target {
+                                ... on Commit {
+                                    oid
+                                    history {
+                                        totalCount
+                                    }
+                                }
+                            }
+                        }
                     }
                 }
                 pageInfo {
@@ -198,43 +518,57 @@ def graph_repos_stars(count_type, owner_affiliation, cursor=None, add_loc=0, del
         }
     }
     """
-    variables = {'owner_affiliation': owner_affiliation, 'login': USER_NAME, 'cursor': cursor}
-    request = simple_request(graph_repos_stars.__name__, query, variables)
-    if count_type == 'repos':
-        return request.json()['data']['user']['repositories']['totalCount']
-    elif count_type == 'stars':
-        return stars_counter(request.json()['data']['user']['repositories']['edges'])
+    variables = {'owner_affiliation': owner_affiliation, 'login': USER_NAME, 'page_size': page_size}
+    return graphql_pages(funct_id, query, variables, ['user', 'repositories'])
 
-def stars_counter(data):
+def graphql_pages(funct_id, query, variables, path, first_page=None, timeout=10, cursor=None):
     """
-    Count total stars in repositories owned by me
+    Streams a cursor-paginated connection one page at a time, where path leads from the response data to the
+    connection (e.g. ['user', 'repositories']) and query takes the cursor as $cursor
+    Each response is parsed once and let go as soon as the next page is requested, so memory stays flat
+    however long the connection is. If first_page is given, it is yielded first and paging resumes from its cursor,
+    otherwise paging starts after cursor
+    Yields nothing if anything along path is null, e.g. the defaultBranchRef of an empty repository
+    Each query is counted under funct_id
     """
-    total_stars = 0
-    for node in data: 
-        total_stars += node['node']['stargazers']['totalCount']
-    return total_stars
+    page, number = first_page, 1
+    while True:
+        if page is None:
+            query_count(funct_id)
+            page = simple_request(funct_id, query, dict(variables, cursor=cursor), timeout, number)
+            for key in path:
+                page = page[key] if page is not None else None
+            if page is None:
+                return
+        yield page
+        if not page['pageInfo']['hasNextPage']:
+            return
+        page, cursor, number = None, page['pageInfo']['endCursor'], number + 1
 
-def recursive_loc(owner, repo_name, data, cache_comment, addition_total=0, deletion_total=0, my_commits=0, cursor=None):
+def recursive_loc(owner, repo_name, stop_oid=None, first_page=None, journal_key=None, resume=None):
     """
     Uses GitHub's GraphQL v4 API and cursor pagination to fetch 100 commits from a repository at a time
+    The pages are streamed through loc_counter_one_repo, which stops early when it reaches stop_oid,
+    the newest commit already counted in the cache, so no further pages are requested
+    first_page is the first history page when loc_batch_query already fetched it
+    If journal_key (repo_hash, commit_count, branch_oid) is given, the progress after every page is appended to the journal,
+    and resume, such a journal record from an interrupted run, picks the crawl up after its cursor
+    Raises CrawlStopped between pages if the crawl is stopping (see crawl_stop)
+    Only my commits are fetched (GitHub filters the history by OWNER_ID), with only the fields counted
+    Returns (addition_total, deletion_total, my_commits, commits_seen, head_oid, history_count), where
+    history_count is the number of my commits on the branch, as reported with the last page
     """
-    query_count('recursive_loc')
     query = """
-    query ($repo_name: String!, $owner: String!, $cursor: String) {
+    query ($repo_name: String!, $owner: String!, $cursor: String, $author_id: ID!) {""" + RATE_LIMIT_FIELD + """
         repository(name: $repo_name, owner: $owner) {
             defaultBranchRef {
                 target {
                     ... on Commit {
-                        history(first: 100, after: $cursor) {
+                        history(first: 100, after: $cursor, author: {id: $author_id}) {
                             totalCount
                             edges {
                                 node {
-                                    committedDate
-                                    author {
-                                        user {
-                                            id
-                                        }
-                                    }
+                                    oid
                                     deletions
                                     additions
                                 }
@@ -250,114 +584,450 @@ def recursive_loc(owner, repo_name, data, cache_comment, addition_total=0, delet
         }
     }
     """
-    variables = {'repo_name': repo_name, 'owner': owner, 'cursor': cursor}
-    request = requests.post('https://api.github.com/graphql', json={'query': query, 'variables': variables}, headers=HEADERS)
-    if request.status_code == 200:
-        if request.json()['data']['repository']['defaultBranchRef'] is not None:  # Only count commits if repo isn't empty
-            return loc_counter_one_repo(owner, repo_name, data, cache_comment, request.json()['data']['repository']['defaultBranchRef']['target']['history'], addition_total, deletion_total, my_commits)
-        else:
-            return 0
-    force_close_file(data, cache_comment)  # saves what is currently in the file before this program crashes
-    if request.status_code == 403:
-        raise Exception("Too many requests in a short amount of time!\nYou've hit the non-documented anti-abuse limit!")
-    raise Exception(f"recursive_loc() has failed with a {request.status_code}, {request.text}, {QUERY_COUNT}")
-
-def loc_counter_one_repo(owner, repo_name, data, cache_comment, history, addition_total, deletion_total, my_commits):
-    """
-    Recursively call recursive_loc (since GraphQL can only search 100 commits at a time) 
-    only adds the LOC value of commits authored by me
-    """
-    for node in history['edges']:
-        if node['node']['author']['user']['id'] == OWNER_ID:
-            my_commits += 1
-            addition_total += node['node']['additions']
-            deletion_total += node['node']['deletions']
-
-    if not history['pageInfo']['hasNextPage']:
-        return addition_total, deletion_total, my_commits
-    else:
-        return recursive_loc(owner, repo_name, data, cache_comment, addition_total, deletion_total, my_commits, history['pageInfo']['endCursor'])
+    variables = {'repo_name': repo_name, 'owner': owner, 'author_id': OWNER_ID}
+    loc, cursor, history_count = [0, 0, 0, 0, None], None, 0
+    if resume is not None:
+        loc, cursor, first_page = resume['loc'], resume['cursor'], None
+    for page in graphql_pages(recursive_loc.__name__, query, variables, ['repository', 'defaultBranchRef', 'target', 'history'],
+                              first_page, HTTP_TIMEOUT, cursor):
+        history_count = page['totalCount']
+        *loc, stopped = loc_counter_one_repo((edge['node'] for edge in page['edges']), stop_oid, *loc)
+        if stopped or not page['pageInfo']['hasNextPage']:
+            break
+        if journal_key is not None:
+            journal_append({'page': journal_key[0], 'count': journal_key[1], 'head': journal_key[2], 'stop': stop_oid,
+                            'cursor': page['pageInfo']['endCursor'], 'loc': loc})
+        if CRAWL_STOP.is_set():  # This page is journaled, the next run picks up after it
+            raise CrawlStopped("The LOC crawl is stopping")
+    return (*loc, history_count)
 
-def loc_query(owner_affiliation, comment_size=0, force_cache=False, cursor=None, edges=[]):
+def loc_batch_query(repos):
     """
-    Uses GitHub's GraphQL v4 API to query all the repositories I have access to (with respect to owner_affiliation)
-    Queries 60 repos at a time, because larger queries give a 502 timeout error and smaller queries send too many
-    requests and also give a 502 error.
-    Returns the total number of lines of code in all repositories
+    Uses GraphQL aliases (r0, r1, ...) to fetch the first 100 commits of several repositories in a single request
+    Returns (history pages in the same order as repos, seconds GitHub took to answer)
+    A page is None when that repository could not be resolved, so the caller can fall back to recursive_loc
+    Returns None if GitHub timed out on the batch (502 or 504), without retrying it, so the caller can
+    retry at once with a smaller one
     """
-    query_count('loc_query')
+    query_count('loc_batch_query')
+    declarations, fields, variables = [], [], {'author_id': OWNER_ID}
+    for index, (owner, repo_name) in enumerate(repos):
+        declarations.append('$owner{0}: String!, $name{0}: String!'.format(index))
+        fields.append('        r{0}: repository(name: $name{0}, owner: $owner{0}) {{ ...historyPage }}'.format(index))
+        variables['owner' + str(index)] = owner
+        variables['name' + str(index)] = repo_name
     query = """
-    query ($owner_affiliation: [RepositoryAffiliation], $login: String!, $cursor: String) {
-        user(login: $login) {
-            repositories(first: 60, after: $cursor, ownerAffiliations: $owner_affiliation) {
-                edges {
-                    node {
-                        nameWithOwner
-                        defaultBranchRef {
-                            target {
-                                ... on Commit {
-                                    history {
-                                        totalCount
-                                    }
-                                }
+    query ($author_id: ID!, """ + ', '.join(declarations) + """) {""" + RATE_LIMIT_FIELD + """
+""" + '\n'.join(fields) + """
+    }
+    fragment historyPage on Repository {
+        defaultBranchRef {
+            target {
+                ... on Commit {
+                    history(first: 100, author: {id: $author_id}) {
+                        totalCount
+                        edges {
+                            node {
+                                oid
+                                deletions
+                                additions
                             }
                         }
+                        pageInfo {
+                            endCursor
+                            hasNextPage
+                        }
                     }
                 }
-                pageInfo {
-                    endCursor
-                    hasNextPage
-                }
             }
         }
     }
     """
-    variables = {'owner_affiliation': owner_affiliation, 'login': USER_NAME, 'cursor': cursor}
-    request = simple_request(loc_query.__name__, query, variables)
-    if request.json()['data']['user']['repositories']['pageInfo']['hasNextPage']:  # If repository data has another page
-        edges += request.json()['data']['user']['repositories']['edges']  # Add on to the LoC count
-        return loc_query(owner_affiliation, comment_size, force_cache, request.json()['data']['user']['repositories']['pageInfo']['endCursor'], edges)
+    request, body = graphql_post(loc_batch_query.__name__, query, variables, retry_timeouts=False)
+    if request.status_code in (502, 504):
+        return None
+    if request.status_code != 200 or body.get('data') is None:
+        raise Exception(f"loc_batch_query() has failed with a {request.status_code}, {request.text}, {QUERY_COUNT}")
+    response = body['data']
+    pages = []
+    for index in range(len(repos)):
+        repository = response.get('r' + str(index))
+        if repository is None:
+            pages.append(None)
+        elif repository['defaultBranchRef'] is None:  # Empty repository
+            pages.append({'totalCount': 0, 'edges': [], 'pageInfo': {'endCursor': None, 'hasNextPage': False}})
+        else:
+            pages.append(repository['defaultBranchRef']['target']['history'])
+    return pages, request.elapsed.total_seconds()
+
+def next_loc_batch_size(batch_size, latency):
+    """
+    Grows the batch while GitHub answers it within LOC_BATCH_TARGET_SECONDS, and shrinks it in proportion once it does not
+    (a batch that times out altogether is halved by loc_crawler)
+    """
+    if latency <= LOC_BATCH_TARGET_SECONDS:
+        return min(LOC_BATCH_MAX_SIZE, batch_size * 2)
+    return max(1, int(batch_size * LOC_BATCH_TARGET_SECONDS / latency))
+
+def loc_counter_one_repo(history, stop_oid=None, addition_total=0, deletion_total=0, my_commits=0, commits_seen=0, head_oid=None):
+    """
+    Walks the commits streamed from recursive_loc, newest first, until the history ends or reaches stop_oid,
+    adding to the totals carried over from the previous pages
+    The history is already filtered by author, so every commit in it is mine
+    Returns (addition_total, deletion_total, my_commits, commits_seen, head_oid, reached stop_oid)
+    """
+    for node in history:
+        if node['oid'] == stop_oid:  # Everything from here on is already in the cache
+            return addition_total, deletion_total, my_commits, commits_seen, head_oid, True
+        if head_oid is None:
+            head_oid = node['oid']
+        commits_seen += 1
+        my_commits += 1
+        addition_total += node['additions']
+        deletion_total += node['deletions']
+    return addition_total, deletion_total, my_commits, commits_seen, head_oid, False
+
+def loc_update_one_repo(owner, repo_name, record, commit_count, branch_oid, first_page=None, resume=None):
+    """
+    Brings the cache record of one repository up to date with its current commit_count (all authors) and branch head
+    If the branch only grew, and my newest cached commit is still in my history, only my commits newer than it are
+    fetched and added to the cached totals. Otherwise (no record, or the history was rewritten) my whole history
+    is counted again
+    Either way the result is checked against the number of my commits GitHub reports
+    first_page is the first history page when loc_batch_query already fetched it, so paging starts from the second
+    resume is the last journaled page of an interrupted crawl of this repository, if any
+    The new CacheRecord is journaled before it is returned
+    """
+    journal_key = (record.repo_hash, commit_count, branch_oid)
+    cached_head = record.head_oid
+    incremental = cached_head is not None and 0 < record.commit_count < commit_count
+    if resume is not None and (resume['count'] != commit_count or resume.get('head') != branch_oid
+                               or resume['stop'] != (cached_head if incremental else None)):
+        resume = None  # Progress towards a different target, it cannot be reused
+    new_record = None
+    if incremental:
+        addition_total, deletion_total, my_commits, commits_seen, head_oid, history_count = recursive_loc(
+            owner, repo_name, cached_head, first_page, journal_key, resume)
+        if record.my_commits + commits_seen == history_count:  # The new commits sit cleanly on top of the cached ones
+            new_record = CacheRecord(record.repo_hash, commit_count, record.my_commits + my_commits, record.additions + addition_total,
+                                     record.deletions + deletion_total, head_oid or cached_head, branch_oid)
+        elif commits_seen < history_count:  # Stopped at the cached head, but some older commits were merged in since
+            addition_total, deletion_total, my_commits, commits_seen, head_oid, history_count = recursive_loc(
+                owner, repo_name, journal_key=journal_key)
     else:
-        return cache_builder(edges + request.json()['data']['user']['repositories']['edges'], comment_size, force_cache)
+        addition_total, deletion_total, my_commits, commits_seen, head_oid, history_count = recursive_loc(
+            owner, repo_name, first_page=first_page, journal_key=journal_key, resume=resume)
+        if resume is not None and commits_seen != history_count:  # The history moved under the resumed cursor, count it again
+            addition_total, deletion_total, my_commits, commits_seen, head_oid, history_count = recursive_loc(
+                owner, repo_name, journal_key=journal_key)
+    if new_record is None:
+        new_record = CacheRecord(record.repo_hash, commit_count, my_commits, addition_total, deletion_total, head_oid, branch_oid)
+    journal_append({'repo': new_record})
+    return new_record
 
-def cache_builder(edges, comment_size, force_cache, loc_add=0, loc_del=0):
+def crawl(tasks, data, cache, workers=LOC_WORKERS):
     """
-    Checks each repository in edges to see if it has been updated since the last time it was cached
-    If it has, run recursive_loc on that repository to update the LOC count
+    Runs a LOC crawl on a pool of `workers` threads. Each task is (update function, its arguments...), and the
+    CacheRecord it returns (already journaled) is written back into data as soon as it is ready
+    tasks may be a generator that does work of its own between tasks (see loc_tasks), drawn from in this thread
+    The first failed repository, or Ctrl-C, stops the whole crawl (see crawl_stop) and is raised again
     """
-    cached = True  # Assume all repositories are cached
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'  # Create a unique filename for each user
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = set()
+        try:
+            for update, *args in tasks:
+                for future in [future for future in futures if future.done()]:
+                    futures.discard(future)
+                    record = future.result()  # Stops drawing tasks early if a repository failed
+                    data[record.repo_hash] = record
+                futures.add(pool.submit(update, *args))
+            for future in as_completed(futures):
+                record = future.result()
+                data[record.repo_hash] = record
+        except BaseException:  # A failed repository, or Ctrl-C (see save_and_exit)
+            crawl_stop(pool, cache)
+            raise
+
+def loc_crawler(jobs, data, cache, workers=LOC_WORKERS):
+    """
+    The GraphQL engine: crawls the repositories in jobs, a list of
+    (owner, repo_name, CacheRecord, commit_count, branch_oid, resume),
+    with loc_update_one_repo (see crawl and loc_tasks)
+    """
+    crawl(loc_tasks(jobs), data, cache, workers)
+
+def loc_tasks(jobs):
+    """
+    Yields the loc_update_one_repo task of each job for crawl, after fetching the first history page of the
+    repositories with loc_batch_query, a batch at a time, so only repositories with more than 100 new commits
+    page through the rest of their history one by one
+    """
+    batch_size = LOC_BATCH_SIZE
+    pending = [job for job in jobs if job[5] is None]
+    for owner, repo_name, record, commit_count, branch_oid, resume in jobs:
+        if resume is not None:  # Picks up after its journaled cursor, the first page is not needed
+            yield loc_update_one_repo, owner, repo_name, record, commit_count, branch_oid, None, resume
+    while pending:
+        batch = pending[:batch_size]
+        result = loc_batch_query([job[:2] for job in batch])
+        if result is None and batch_size > 1:  # GitHub timed out on a batch this big
+            batch_size = max(1, batch_size // 2)
+            continue
+        first_pages, latency = result if result is not None else ([None], LOC_BATCH_TARGET_SECONDS)
+        pending = pending[len(batch):]
+        for (owner, repo_name, record, commit_count, branch_oid, resume), first_page in zip(batch, first_pages):
+            yield loc_update_one_repo, owner, repo_name, record, commit_count, branch_oid, first_page, resume
+        batch_size = next_loc_batch_size(batch_size, latency)
+
+def git_crawler(jobs, data, cache, workers=LOC_WORKERS):
+    """
+    The git engine: crawls the repositories in jobs, as loc_crawler takes them, with git_update_one_repo
+    (see crawl), with at most `workers` fetches or git logs running at once
+    """
+    crawl(((git_update_one_repo, *job) for job in jobs), data, cache, workers)
+
+def git_update_one_repo(owner, repo_name, record, commit_count, branch_oid, resume=None):
+    """
+    The git engine's loc_update_one_repo: fetches the repository into its clone and counts my whole history there,
+    which takes no API request however long the history is, and cannot double count after a rewrite or a merge
+    Falls back to loc_update_one_repo if git fails, e.g. on a private repository it cannot reach
+    The new CacheRecord is journaled before it is returned
+    """
+    import subprocess
+    if CRAWL_STOP.is_set():
+        raise CrawlStopped("The LOC crawl is stopping")
     try:
-        with open(filename, 'r') as f:
-            for line in f:
-                if line.split(' ')[0] == 'data':
-                    data = int(line.split(' ')[1])
-                    cache_comment = int(line.split(' ')[2])
-                    if (comment_size > 0 and cache_comment != comment_size) or force_cache:  # If the cache is invalid
-                        os.remove(filename)
-                        cached = False
-                        break
-    except FileNotFoundError:
+        addition_total, deletion_total, my_commits, head_oid = git_loc(git_fetch(owner, repo_name))
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"git could not count {owner}/{repo_name}, falling back to the GraphQL API: {str(e)}")
+        return loc_update_one_repo(owner, repo_name, record, commit_count, branch_oid, None, resume)
+    new_record = CacheRecord(record.repo_hash, commit_count, my_commits, addition_total, deletion_total, head_oid, branch_oid)
+    journal_append({'repo': new_record})
+    return new_record
+
+def git_environment():
+    """
+    Returns the environment git runs in: never prompting, and authenticated with ACCESS_TOKEN over https
+    The token goes in through the environment rather than the command line, where other users could see it
+    """
+    import base64
+    environment = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    token = os.environ.get('ACCESS_TOKEN')
+    if token and GIT_REMOTE.startswith('https://'):
+        credentials = base64.b64encode(('x-access-token:' + token).encode('utf-8')).decode('ascii')
+        environment.update(GIT_CONFIG_COUNT='1', GIT_CONFIG_KEY_0='http.extraHeader',
+                           GIT_CONFIG_VALUE_0='Authorization: Basic ' + credentials)
+    return environment
+
+def git_fetch(owner, repo_name):
+    """
+    Brings the bare clone of a repository up to date with its default branch (at GIT_HEAD_REF), creating it
+    on first use; later fetches only transfer the new objects
+    Returns the clone's directory
+    """
+    import subprocess
+    directory = os.path.join(GIT_CLONE_DIR, owner, repo_name + '.git')
+    if not os.path.isdir(directory):
+        subprocess.run(['git', 'init', '--quiet', '--bare', directory], check=True, capture_output=True)
+    subprocess.run(['git', '-C', directory, 'fetch', '--quiet', '--no-tags', '--force',
+                    GIT_REMOTE.format(owner + '/' + repo_name), '+HEAD:' + GIT_HEAD_REF],
+                   check=True, capture_output=True, env=git_environment())
+    return directory
+
+def git_loc(directory):
+    """
+    Streams git log --numstat over the default branch of a clone, my commits only, one line at a time
+    Merge commits are diffed against their first parent, and binary files count as no lines
+    Returns (addition_total, deletion_total, my_commits, head_oid), where head_oid is my newest commit
+    """
+    import subprocess
+    emails = [r'([0-9]+\+)?' + re.escape(USER_NAME) + r'@users\.noreply\.github\.com'] + [re.escape(email) for email in GIT_AUTHOR_EMAILS]
+    command = ['git', '-C', directory, 'log', '--numstat', '--format=%x00%H', '--diff-merges=first-parent',
+               '--extended-regexp', '--regexp-ignore-case', '--author=<(' + '|'.join(emails) + ')>', GIT_HEAD_REF, '--']
+    addition_total, deletion_total, my_commits, head_oid = 0, 0, 0, None
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace') as log:
+        for line in log.stdout:
+            if line.startswith('\0'):  # A commit
+                my_commits += 1
+                head_oid = head_oid or line[1:].strip()
+            elif '\t' in line:  # additions, deletions and path of one file, '-' for binary files
+                additions, deletions, _ = line.split('\t', 2)
+                if additions != '-':
+                    addition_total += int(additions)
+                    deletion_total += int(deletions)
+        stderr = log.stderr.read()
+    if log.returncode != 0:
+        raise subprocess.CalledProcessError(log.returncode, command, stderr=stderr)
+    return addition_total, deletion_total, my_commits, head_oid
+
+def loc_crawl_eta(jobs, stored):
+    """
+    Projects how long loc_crawler will take on jobs, from the number of queries it needs and the rate limit left
+    Only my commits are paged through, so each repository's new commits are scaled by my share of it in the stored
+    cache; a repository that was never counted is taken to be all mine, so a first run's projection is an upper bound
+    Returns (seconds, queries)
+    """
+    pages = 0
+    for owner, repo_name, record, commit_count, branch_oid, resume in jobs:
+        new_commits = commit_count - record.commit_count if 0 < record.commit_count < commit_count else commit_count
+        known = stored.get(record.repo_hash)
+        if known is not None and known.commit_count:
+            new_commits = math.ceil(new_commits * min(1, known.my_commits / known.commit_count))
+        pages += max(0, math.ceil(new_commits / 100) - 1)  # The first page comes with loc_batch_query
+    pending = {'loc_batch_query': math.ceil(len(jobs) / LOC_BATCH_SIZE), 'recursive_loc': pages}
+    return rate_limit_eta(pending), sum(pending.values())
+
+class Repository(NamedTuple):
+    """
+    One repository of the listing, flattened out of its GraphQL node as soon as the page arrives
+    A tuple of five fields, with no per-instance dict, so a listing of tens of thousands stays small
+    """
+    name: str  # nameWithOwner
+    owner: str
+    stars: int
+    head_oid: Optional[str]  # None for an empty repository
+    commit_count: int  # Commits on the default branch, by anyone
+
+    @classmethod
+    def from_node(cls, node: Dict) -> 'Repository':
+        """Flattens a repository node as fetched by repository_pages or repository_getter"""
+        branch = node['defaultBranchRef']
+        return cls(node['nameWithOwner'], sys.intern(node['owner']['login']), node['stargazers']['totalCount'],
+                   branch['target']['oid'] if branch else None, branch['target']['history']['totalCount'] if branch else 0)
+
+def repository_stars(repos: List[Repository], owner: str) -> int:
+    """
+    Returns the total stars of the repositories in repos owned by owner
+    """
+    return sum(repo.stars for repo in repos if repo.owner.lower() == owner.lower())
+
+def loc_query(owner_affiliation):
+    """
+    Uses GitHub's GraphQL v4 API to query all the repositories I have access to (with respect to owner_affiliation)
+    Queries 60 repos at a time, because larger queries give a 502 timeout error and smaller queries send too many
+    requests and also give a 502 error.
+    The stars of the repositories I own are counted from the same pages, so they need no listing of their own
+    Each page is flattened into Repository records and let go, and the records are kept so fast_path_state
+    can check their heads before cache_builder is run at all
+    Returns (every repository, total stars)
+    """
+    repos = []
+    for page in repository_pages(loc_query.__name__, owner_affiliation):
+        repos.extend(Repository.from_node(edge['node']) for edge in page['edges'])
+    return repos, repository_stars(repos, USER_NAME)
+
+def heads_fingerprint(repos):
+    """
+    Returns a hash of every repository's name, head commit and commit count (and of the cache backend),
+    which changes whenever anything cache_builder or commit_counter would count has changed
+    """
+    heads = sorted([repo.name, repo.head_oid, repo.commit_count] for repo in repos)
+    return hashlib.sha256(json.dumps([USER_NAME, OWNER_ID, CACHE_BACKEND, heads]).encode('utf-8')).hexdigest()
+
+def state_load():
+    """
+    Returns the state saved by state_save for USER_NAME, or an empty one
+    """
+    try:
+        with open(STATE_FILE.format(hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest()), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def state_save(state):
+    """
+    Saves the state of USER_NAME for the next run
+    """
+    filename = STATE_FILE.format(hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest())
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+def reconcile_due(state, metric):
+    """
+    Returns True if metric was last computed from scratch more than RECONCILE_DAYS ago
+    """
+    reconciled = state.get('reconciled', {}).get(metric)
+    if reconciled is None:  # Computed before these timestamps were kept, or never: the first run starts the clock
+        return False
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(reconciled.replace('Z', '+00:00'))
+    return RECONCILE_DAYS > 0 and age > timedelta(days=RECONCILE_DAYS)
+
+def reconciled(state, metric):
+    """
+    Records in state that metric was just computed from scratch
+    """
+    state.setdefault('reconciled', {})[metric] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def fast_path_state(fingerprint, state):
+    """
+    Returns state if its totals were computed from the same repository heads,
+    and the cache they came from is still there (with no interrupted crawl waiting in its journal)
+    Otherwise returns None, and everything is recomputed
+    """
+    user_hash = hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest()
+    cache_file = CACHE_DB if CACHE_BACKEND == 'sqlite' else 'cache/' + user_hash + '.txt'
+    if not os.path.exists(cache_file) or os.path.exists('cache/' + user_hash + '.journal'):
+        return None
+    return state if state.get('fingerprint') == fingerprint else None
+
+def cache_builder(repos, comment_size, force_cache, loc_add=0, loc_del=0, epoch=None):
+    """
+    Checks each Repository in repos (any iterable) to see if it has been updated since the last time it was cached
+    If it has, fetch only its new commits (see loc_update_one_repo) to update the LOC count,
+    or with LOC_ENGINE=git, count its history again in a local clone (see git_update_one_repo)
+    The cache (see cache_backend) holds one CacheRecord per repository
+    Progress is appended to a journal as it is made, and a run that was interrupted resumes from it; with force_cache,
+    only a run of the same full recount, epoch, resumes (see journal_replay)
+    Once every repository is up to date, only the records that changed are written to the cache, and those of
+    deleted repositories removed, in one go; nothing is written if nothing changed
+    Returns [loc_add, loc_del, loc_add - loc_del, cached]
+    """
+    cached = True  # Assume all repositories are cached
+    cache = cache_backend(comment_size)
+    stored = cache.load()
+    data = {} if force_cache else dict(stored)
+    progress = journal_replay(cache.journal, data, force_cache, epoch)
+
+    jobs, repo_hashes = [], set()
+    for repo in repos:  # May be a generator, so it is only walked once
+        repo_hash = hashlib.sha256(repo.name.encode('utf-8')).hexdigest()
+        repo_hashes.add(repo_hash)
+        record = data.get(repo_hash) or CacheRecord(repo_hash)
+        if repo.head_oid is None:  # Empty repository, nothing to count
+            data[repo_hash] = CacheRecord(repo_hash)
+            continue
+        if record.branch_oid is None and record.commit_count == repo.commit_count:  # Kept from before branch_oid was
+            record = record._replace(branch_oid=repo.head_oid)  # recorded, it is taken to be of the current head
+        data[repo_hash] = record
+        if record.commit_count != repo.commit_count or record.branch_oid != repo.head_oid:  # Grew, or was rewritten
+            owner, repo_name = repo.name.split('/')
+            jobs.append((owner, repo_name, record, repo.commit_count, repo.head_oid, progress.get(repo_hash)))
+    if LOC_ENGINE not in ('graphql', 'git'):
+        raise ValueError(f"Unknown LOC_ENGINE: {LOC_ENGINE}")
+    if jobs:
         cached = False
-    if not cached:  # If any repository is not cached
-        with open(filename, 'w') as f:
-            for i in edges:
-                if i['node']['defaultBranchRef'] is not None:
-                    data = int(time.mktime(time.strptime(i['node']['defaultBranchRef']['target']['history']['edges'][0]['node']['committedDate'], '%Y-%m-%dT%H:%M:%SZ')))
-                    cache_comment = comment_size
-                    f.write('data {} {}\n'.format(data, cache_comment))
-                    addition_total, deletion_total, my_commits = recursive_loc(USER_NAME, i['node']['nameWithOwner'].split('/')[1], data, cache_comment)
-                    loc_add += addition_total
-                    loc_del += deletion_total
-        with open(filename, 'w') as f:  # Save the file in case the program crashes again
-            f.write('data {} {}\n'.format(data, cache_comment))
-            f.write('comment_size {} {}\n'.format(comment_size, loc_add - loc_del))
-            return loc_add - loc_del
-    else:
-        with open(filename, 'r') as f:
-            for line in f:
-                if line.split(' ')[0] == 'comment_size':
-                    return int(line.split(' ')[2])
+        if LOC_ENGINE == 'graphql':
+            print('LOC crawl projected: about {:.1f} s for {:,} queries'.format(*loc_crawl_eta(jobs, stored)))
+        journal_open(cache.journal, epoch if force_cache else None)
+        try:
+            (git_crawler if LOC_ENGINE == 'git' else loc_crawler)(jobs, data, cache)
+        finally:
+            journal_close()
+
+    data = {repo_hash: record for repo_hash, record in data.items() if repo_hash in repo_hashes}  # Forget deleted repositories
+    changed = {repo_hash: record for repo_hash, record in data.items() if stored.get(repo_hash) != record}
+    removed = [repo_hash for repo_hash in stored if repo_hash not in data]
+    if changed or removed:
+        cache.upsert(changed, removed)  # Compacts the journal into the cache
+    journal_remove(cache.journal)
+    for record in data.values():
+        loc_add += record.additions
+        loc_del += record.deletions
+    return [loc_add, loc_del, loc_add - loc_del, cached]
 
 def svg_overwrite(
     filename: str,
@@ -367,9 +1037,13 @@ def svg_overwrite(
     repo_data: str,
     contrib_data: str,
     follower_data: str,
-    loc_data: Tuple[str, str, str]
-) -> None:
-    """Updates SVG file with validation."""
+    loc_data: Tuple[str, str, str],
+    optional: Optional[Dict[str, str]] = None
+) -> bool:
+    """
+    Updates SVG file with validation, returns False if it already held these values.
+    optional maps slot ids to values for slots that templates may leave out, e.g. contributions_data
+    """
     if not os.path.exists(filename):
         raise FileNotFoundError(f"SVG file not found: {filename}")
     if not filename.lower().endswith('.svg'):
@@ -392,103 +1066,166 @@ def svg_overwrite(
     if not isinstance(loc_data, (tuple, list)) or len(loc_data) != 3:
         raise ValueError("loc_data must be a tuple/list of 3 strings")
     
+    values = {
+        'age_data': age_data,
+        'repo_data': repo_data,
+        'contrib_data': contrib_data,
+        'commit_data': commit_data,
+        'star_data': star_data,
+        'follower_data': follower_data,
+        'loc_data': loc_data[2],
+        'loc_add': loc_data[0] + '++',
+        'loc_del': loc_data[1] + '--'
+    }
     try:
-        svg = minidom.parse(filename)
-        tspan = svg.getElementsByTagName('tspan')
-        
-        # Validate that all required indices exist
-        required_indices = [30, 65, 67, 69, 71, 73, 75, 76, 77]
-        max_index = len(tspan) - 1
-        
-        if max_index < max(required_indices):
-            raise ValueError(f"SVG file doesn't have enough tspan elements. Found {max_index + 1}, need {max(required_indices) + 1}")
-        
-        tspan[30].firstChild.data = age_data
-        tspan[65].firstChild.data = repo_data
-        tspan[67].firstChild.data = contrib_data
-        tspan[69].firstChild.data = commit_data
-        tspan[71].firstChild.data = star_data
-        tspan[73].firstChild.data = follower_data
-        tspan[75].firstChild.data = loc_data[2]
-        tspan[76].firstChild.data = loc_data[0] + '++'
-        tspan[77].firstChild.data = loc_data[1] + '--'
-        f.write(svg.toxml('utf-8').decode('utf-8'))
-        f.close()
+        slot_ids = {slot_id for slot_id, _ in svg_compile(filename)[1]}
+        values.update((slot_id, value) for slot_id, value in (optional or {}).items() if slot_id in slot_ids)
+        return svg_fill(filename, values)
     except Exception as e:
         raise ValueError(f"Failed to process SVG file: {str(e)}")
 
-def commit_counter(comment_size):
+def svg_compile(filename):
     """
-    Counts up my total commits, using the cache file created by cache_builder.
+    Splits an SVG file into the static bytes around its slots, so filling it in is a plain join
+    Returns (chunks, slots, current bytes of the file), where slots is a list of (id, current text)
+    and the file is chunks[0] + slots[0] text + chunks[1] + ... + chunks[-1]
+    The file is only split again when it changes on disk, and svg_fill's own writes do not count as a change
     """
-    total_commits = 0
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'  # Use the same filename as cache_builder
-    with open(filename, 'r') as f:
-        data = f.readlines()
-    cache_comment = data[:comment_size]  # save the comment block
-    data = data[comment_size:]  # remove those lines
-    for line in data:
-        total_commits += int(line.split()[2])
-    return total_commits
+    stat = os.stat(filename)
+    compiled = SVG_TEMPLATES.get(filename)
+    if compiled is not None and compiled[0] == (stat.st_mtime_ns, stat.st_size):
+        return compiled[1], compiled[2], compiled[3]
+    with open(filename, 'rb') as f:
+        svg = f.read()
+    chunks, slots, start = [], [], 0
+    for match in SVG_SLOT.finditer(svg):
+        chunks.append(svg[start:match.end(1)])
+        slots.append((match.group(2).decode('utf-8'), match.group(3)))
+        start = match.start(4)
+    chunks.append(svg[start:])
+    SVG_TEMPLATES[filename] = ((stat.st_mtime_ns, stat.st_size), chunks, slots, svg)
+    return chunks, slots, svg
 
-def svg_element_getter(filename):
+def svg_fill(filename, values):
     """
-    Prints the element index of every element in the SVG file
+    Writes values, slot id -> text, into the slots of an SVG file (slots missing from values keep their text)
+    The file is replaced atomically, and not written at all if nothing changed, so git sees no difference
+    Returns True if the file was written
     """
-    svg = minidom.parse(filename)
-    open(filename, mode='r', encoding='utf-8')
-    tspan = svg.getElementsByTagName('tspan')
-    for index in range(len(tspan)):
-        print(index, tspan[index].firstChild.data)
+    chunks, slots, current = svg_compile(filename)
+    missing = set(values) - {slot_id for slot_id, _ in slots}
+    if missing:
+        raise ValueError(f"SVG file has no element with id {', '.join(sorted(missing))}")
+    parts = [chunks[0]]
+    for (slot_id, text), chunk in zip(slots, chunks[1:]):
+        parts.append(escape(values[slot_id], quote=False).encode('utf-8') if slot_id in values else text)
+        parts.append(chunk)
+    svg = b''.join(parts)
+    if svg == current:
+        return False
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(svg)
+    os.replace(filename + '.tmp', filename)
+    stat = os.stat(filename)
+    slots = [(slot_id, escape(values[slot_id], quote=False).encode('utf-8') if slot_id in values else text) for slot_id, text in slots]
+    SVG_TEMPLATES[filename] = ((stat.st_mtime_ns, stat.st_size), chunks, slots, svg)
+    return True
 
-def user_getter(username):
+def commit_counter(comment_size):
     """
-    Returns the account ID and creation time of the user
+    Counts up my total commits, using the cache created by cache_builder.
     """
-    query_count('user_getter')
-    query = """
-    query ($login: String!) {
-        user(login: $login) {
-            id
-            createdAt
-        }
-    }
+    return sum(record.my_commits for record in cache_backend(comment_size).load().values())
+
+def svg_element_getter(filename):
     """
-    variables = {'login': username}
-    request = simple_request(user_getter.__name__, query, variables)
-    return {'id': request.json()['data']['user']['id']}, request.json()['data']['user']['createdAt']
+    Prints the id and current text of every slot in the SVG file
+    """
+    for slot_id, text in svg_compile(filename)[1]:
+        print(slot_id, text.decode('utf-8'))
+
+class ProfileStats(NamedTuple):
+    """The cheap per-user stats, all fetched by profile_getter in one request"""
+    id: str
+    created_at: str
+    followers: int
+    repos: int  # Repositories owned by the user
+    contributed: int  # Repositories owned, collaborated on, or reachable through an organization
+    stars: int = 0  # Stars on owned repositories, counted by loc_query from its repository listing
+    lifetime_contributions: int = 0  # Contributions since the account was created, if a card shows them, see contributions_delta
 
-def follower_getter(username):
+def profile_getter(username: str) -> ProfileStats:
     """
-    Returns the number of followers of the user
+    Returns the account ID, creation time, follower and repository counts of the user, all in one request
     """
-    query_count('follower_getter')
+    query_count('profile_getter')
     query = """
-    query ($login: String!) {
+    query ($login: String!) {""" + RATE_LIMIT_FIELD + """
         user(login: $login) {
+            id
+            createdAt
             followers {
                 totalCount
             }
+            repositories(first: 1, ownerAffiliations: [OWNER]) {
+                totalCount
+            }
+            contributed: repositories(first: 1, ownerAffiliations: [OWNER, COLLABORATOR, ORGANIZATION_MEMBER]) {
+                totalCount
+            }
         }
     }
     """
-    request = simple_request(follower_getter.__name__, query, {'login': username})
-    return int(request.json()['data']['user']['followers']['totalCount'])
+    user = simple_request(profile_getter.__name__, query, {'login': username})['user']
+    return ProfileStats(
+        id=user['id'],
+        created_at=user['createdAt'],
+        followers=int(user['followers']['totalCount']),
+        repos=int(user['repositories']['totalCount']),
+        contributed=int(user['contributed']['totalCount']),
+    )
+
+def svg_render(filenames: List[str], profile: ProfileStats, age_data: str, commit_data: int, loc_data: List[int]) -> None:
+    """
+    Formats the stats in profile, along with the age, commit and [additions, deletions, total] LOC counts,
+    once, and writes them into every SVG file (one per theme)
+    """
+    for filename in filenames:
+        svg_overwrite(
+            filename,
+            age_data,
+            '{:,}'.format(commit_data).ljust(7),  # Padded to keep the '|' separators lined up
+            '{:,}'.format(profile.stars),
+            '{:,}'.format(profile.repos),
+            '{:,}'.format(profile.contributed),
+            '{:,}'.format(profile.followers).ljust(4),
+            tuple('{:,}'.format(loc) for loc in loc_data[:3]),
+            {'contributions_data': '{:,}'.format(profile.lifetime_contributions)}
+        )
 
 def query_count(funct_id):
     """
     Counts how many times the GitHub GraphQL API is called
     """
     global QUERY_COUNT
-    QUERY_COUNT[funct_id] += 1
+    with QUERY_COUNT_LOCK:  # loc_crawler calls this from several threads
+        QUERY_COUNT[funct_id] += 1
 
-def perf_counter(funct, *args):
+def retry_count(funct_id, delay):
+    """
+    Counts how many GitHub GraphQL API calls were retried, and how many seconds were spent waiting to retry them
+    """
+    with QUERY_COUNT_LOCK:
+        RETRY_COUNT[funct_id] = RETRY_COUNT.get(funct_id, 0) + 1
+        RETRY_TIME[funct_id] = RETRY_TIME.get(funct_id, 0.0) + delay
+
+def perf_counter(funct, *args, **kwargs):
     """
     Calculates the time it takes for a function to run
     Returns the function result and the time differential
     """
     start = time.perf_counter()
-    funct_return = funct(*args)
+    funct_return = funct(*args, **kwargs)
     return funct_return, time.perf_counter() - start
 
 def formatter(query_type, difference, funct_return=False, whitespace=0):
@@ -502,34 +1239,647 @@ def formatter(query_type, difference, funct_return=False, whitespace=0):
         return f"{'{:,}'.format(funct_return): <{whitespace}}"
     return funct_return
 
-def force_close_file(data, cache_comment):
+def trace_span(func_name, variables, page, start, waited, retries, request, body):
+    """
+    Records one GraphQL request, retries included, as a span: the function, the repository (or how many
+    a batch covered), the page and cursor, the latency (time waiting on the rate limit and on backoff excluded,
+    and kept as wait), the response size, the retries, the status and the GraphQL cost
+    """
+    end = time.perf_counter()
+    repo = variables['owner'] + '/' + variables['repo_name'] if 'repo_name' in variables else None
+    batch = sum(1 for name in variables if name.startswith('owner') and name[5:].isdigit())  # loc_batch_query's $owner0...
+    rate_limit = ((body or {}).get('data') or {}).get('rateLimit') or {}
+    span = {'user': USER_NAME, 'function': func_name, 'repo': repo, 'batch': batch, 'page': page,
+            'cursor': variables.get('cursor'), 'start': start - TRACE['start'], 'latency': end - start - waited,
+            'wait': waited, 'size': len(request.content), 'retries': retries, 'status': request.status_code,
+            'cost': rate_limit.get('cost'), 'thread': threading.get_ident()}
+    with TRACE_LOCK:
+        TRACE['spans'].append(span)
+
+def trace_flush():
+    """
+    Prints the summary of the spans recorded so far and writes them to TRACE['file'], then lets them go
+    Serve mode flushes after every refresh, so the file holds the spans of the last one
+    """
+    with TRACE_LOCK:
+        spans, TRACE['spans'] = TRACE['spans'], []
+    if TRACE['file'] and spans:
+        trace_summary(spans)
+        trace_write(TRACE['file'], spans)
+
+def trace_write(filename, spans):
     """
-    Close file safely
+    Writes spans to filename, as a Chrome trace if it ends in .json, otherwise as JSON lines
     """
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'
-    with open(filename, 'w') as f:
-        f.write('data {} {}\n'.format(data, cache_comment))
-    return
+    with open(filename + '.tmp', 'w') as f:
+        if filename.endswith('.json'):
+            events = [{'name': span['function'] + (' ' + span['repo'] if span['repo'] else ''), 'cat': 'graphql', 'ph': 'X',
+                       'ts': (span['start'] + span['wait']) * 1e6, 'dur': span['latency'] * 1e6, 'pid': 1,
+                       'tid': span['thread'], 'args': span} for span in spans]
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        else:
+            for span in spans:
+                f.write(json.dumps(span) + '\n')
+    os.replace(filename + '.tmp', filename)
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of values (sorted), e.g. fraction=0.95 for p95
+    """
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def trace_summary(spans, slowest=10):
+    """
+    Prints the p50/p95/max latency and response bytes of each query function,
+    and the slowest repositories by the total latency of their history pages
+    """
+    functions, repos = {}, {}
+    for span in spans:
+        functions.setdefault(span['function'], []).append(span)
+        if span['repo'] is not None:
+            repos.setdefault(span['repo'], []).append(span)
+    print('Query latency:', '{:>7}{:>12}{:>12}{:>12}{:>12}'.format('calls', 'p50', 'p95', 'max', 'bytes'))
+    for funct_name, funct_spans in functions.items():
+        latencies = sorted(span['latency'] for span in funct_spans)
+        print('{:<23}'.format('   ' + funct_name + ':'), '{:>6}'.format(len(latencies)),
+              *('{:>11}'.format('%.1f ms' % (latency * 1000)) for latency in (percentile(latencies, 0.5), percentile(latencies, 0.95), latencies[-1])),
+              '{:>11,}'.format(sum(span['size'] for span in funct_spans)))
+    if repos:
+        print('Slowest repositories:', '{:>12}{:>8}{:>10}'.format('latency', 'pages', 'retries'))
+        ranked = sorted(repos.items(), key=lambda item: sum(span['latency'] for span in item[1]), reverse=True)
+        for repo, repo_spans in ranked[:slowest]:
+            print('{:<34}'.format('   ' + repo), '{:>11}'.format('%.1f ms' % (sum(span['latency'] for span in repo_spans) * 1000)),
+                  '{:>7}'.format(len(repo_spans)), '{:>9}'.format(sum(span['retries'] for span in repo_spans)))
+
+def journal_open(journal, epoch=None):
+    """
+    Opens a cache's journal for appending, and marks what this run appends to it as the work of the full recount
+    epoch (None if it is not one), see journal_replay
+    """
+    with JOURNAL_LOCK:
+        JOURNAL['fd'] = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    journal_append({'epoch': epoch})
+
+def journal_close():
+    """
+    Closes the journal, if it is open
+    """
+    with JOURNAL_LOCK:
+        if JOURNAL['fd'] is not None:
+            os.close(JOURNAL['fd'])
+            JOURNAL['fd'] = None
+
+def journal_append(record):
+    """
+    Appends one record to the journal as a single JSON line, in one write, and fsyncs it before returning,
+    so a crash can at worst tear the last line (which journal_replay then ignores)
+    Does nothing if no journal is open
+    """
+    line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+    with JOURNAL_LOCK:
+        if JOURNAL['fd'] is None:
+            return
+        os.write(JOURNAL['fd'], line)
+        os.fsync(JOURNAL['fd'])
+
+def journal_replay(journal, data, force_cache=False, epoch=None):
+    """
+    Applies the journal left behind by an interrupted run to the cache records in data
+    Finished repositories replace their cache record. Returns the last page record of each repository that was
+    still being crawled, repo_hash -> {'count', 'head', 'stop', 'cursor', 'loc'}, for recursive_loc to resume from
+    If force_cache is set, only what was journaled by the same full recount, epoch, is applied: anything else
+    was counted on top of the cache that is being recounted
+    """
+    progress, current = {}, None
+    try:
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # Torn by a crash mid-write
+                    continue
+                if 'epoch' in record:  # Written by journal_open, applies to the records that follow
+                    current = record['epoch']
+                elif force_cache and (epoch is None or current != epoch):
+                    continue
+                elif 'repo' in record and isinstance(record['repo'], list):  # Not a text line from an older version
+                    repo_record = CacheRecord(*record['repo'])
+                    data[repo_record.repo_hash] = repo_record
+                    progress.pop(repo_record.repo_hash, None)
+                elif 'page' in record:
+                    progress[record['page']] = record
+    except FileNotFoundError:
+        pass
+    return progress
+
+def journal_remove(journal):
+    """
+    Deletes a journal once everything in it has made it into the cache
+    """
+    if os.path.exists(journal):
+        os.remove(journal)
+
+class CacheRecord(NamedTuple):
+    """
+    What the cache keeps about one repository, as every backend (see cache_backend) takes and returns it,
+    and as the journal holds it (a JSON list)
+    """
+    repo_hash: str  # sha256 of nameWithOwner
+    commit_count: int = 0  # Commits on the default branch, by anyone, when the record was made
+    my_commits: int = 0
+    additions: int = 0
+    deletions: int = 0
+    head_oid: Optional[str] = None  # My newest commit on the branch, None if I have none
+    branch_oid: Optional[str] = None  # The branch head it was counted at, None in a cache from before it was kept
+
+class TextCache:
+    """
+    The plain text cache, cache/<sha256(user)>.txt, compact enough to commit to git: comment_size comment lines,
+    then one line per repository: repo_hash commit_count my_commits additions deletions head_oid branch_oid
+    ('-' for None; a line from before branch_oid was kept has no such field)
+    """
+    def __init__(self, user: str, comment_size: int = 0):
+        self.filename = 'cache/' + hashlib.sha256(user.encode('utf-8')).hexdigest() + '.txt'  # Create a unique filename for each user
+        self.journal = self.filename[:-len('.txt')] + '.journal'
+        self.comment_size = comment_size
+        self.comment = []
+        self.records = None
+
+    def load(self) -> Dict[str, CacheRecord]:
+        """Returns every record, repo_hash -> CacheRecord, reading the file only the first time"""
+        if self.records is None:
+            try:
+                with open(self.filename, 'r') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+            self.comment, self.records = [], {}
+            for line in lines:
+                fields = line.split()
+                if len(fields) in (6, 7) and len(fields[0]) == 64:  # A repository record
+                    self.records[fields[0]] = CacheRecord(fields[0], *map(int, fields[1:5]),
+                                                          *[None if field == '-' else field for field in fields[5:]])
+                else:
+                    self.comment.append(line)
+        return dict(self.records)
+
+    def upsert(self, records: Dict[str, CacheRecord], removed: List[str] = ()) -> None:
+        """
+        Adds or replaces the given records and deletes those of the removed repo_hashes, keeping all others
+        A text file cannot be patched in place, so it is atomically replaced, comment block included
+        """
+        self.load()
+        records = {**self.records, **records}
+        for repo_hash in removed:
+            records.pop(repo_hash, None)
+        comment = self.comment[:self.comment_size]
+        while len(comment) < self.comment_size:
+            comment.append('This line is a comment block. Write whatever you want here.\n')
+        with open(self.filename + '.tmp', 'w') as f:
+            f.writelines(comment)
+            f.writelines('{} {} {} {} {} {} {}\n'.format(*record[:5], record.head_oid or '-', record.branch_oid or '-')
+                         for record in records.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.filename + '.tmp', self.filename)
+        self.records = records
+
+class SqliteCache:
+    """
+    The SQLite cache, one database for any number of users, with the records indexed by (user, repo_hash)
+    Every batch of records is written in a single transaction
+    """
+    def __init__(self, user: str, database: str = CACHE_DB):
+        self.user = user
+        self.journal = 'cache/' + hashlib.sha256(user.encode('utf-8')).hexdigest() + '.journal'
+        import sqlite3
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS repositories (
+                    user TEXT NOT NULL,
+                    repo_hash TEXT NOT NULL,
+                    commit_count INTEGER NOT NULL,
+                    my_commits INTEGER NOT NULL,
+                    additions INTEGER NOT NULL,
+                    deletions INTEGER NOT NULL,
+                    head_oid TEXT NOT NULL,
+                    branch_oid TEXT NOT NULL DEFAULT '-',
+                    PRIMARY KEY (user, repo_hash)
+                ) WITHOUT ROWID
+            """)
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(repositories)')]
+            if 'branch_oid' not in columns:  # A database from before branch_oid was kept
+                self.connection.execute("ALTER TABLE repositories ADD COLUMN branch_oid TEXT NOT NULL DEFAULT '-'")
+
+    def load(self) -> Dict[str, CacheRecord]:
+        """Returns every record of the user, repo_hash -> CacheRecord, read along the (user, repo_hash) key"""
+        rows = self.connection.execute('SELECT repo_hash, commit_count, my_commits, additions, deletions, head_oid, branch_oid '
+                                       'FROM repositories WHERE user = ?', (self.user,))
+        return {row[0]: CacheRecord(*row[:5], *[None if oid == '-' else oid for oid in row[5:]]) for row in rows}
+
+    def upsert(self, records: Dict[str, CacheRecord], removed: List[str] = ()) -> None:
+        """
+        Adds or replaces the given records and deletes those of the removed repo_hashes, in one transaction,
+        leaving every other row (of this user or any other) untouched
+        """
+        rows = [(self.user, *record[:5], record.head_oid or '-', record.branch_oid or '-')  # The oids are NOT NULL
+                for record in records.values()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO repositories (user, repo_hash, commit_count, my_commits, '
+                                        'additions, deletions, head_oid, branch_oid) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('DELETE FROM repositories WHERE user = ? AND repo_hash = ?',
+                                        [(self.user, repo_hash) for repo_hash in removed])
+
+def cache_backend(comment_size=0, user=None):
+    """
+    Returns the cache of user (USER_NAME by default) in the backend chosen by CACHE_BACKEND
+    The same one every time, so the text cache is read from disk once per process
+    """
+    user = user or USER_NAME
+    key = (CACHE_BACKEND, user, comment_size)
+    if key not in CACHES:
+        if CACHE_BACKEND == 'sqlite':
+            CACHES[key] = SqliteCache(user)
+        elif CACHE_BACKEND == 'text':
+            CACHES[key] = TextCache(user, comment_size)
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+    return CACHES[key]
+
+class CrawlStopped(Exception):
+    """Raised in the workers of a LOC crawl that is being stopped, see crawl_stop"""
+
+def crawl_stop(pool, cache):
+    """
+    Stops a LOC crawl after its first failed repository, or Ctrl-C: queued repositories are cancelled, running
+    ones give up before their next request (CrawlStopped), and this returns once every worker has,
+    so cache_builder only closes the journal after their last record is in it
+    """
+    CRAWL_STOP.set()
+    try:
+        pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        CRAWL_STOP.clear()
+    force_close_file(cache)
+
+def force_close_file(cache):
+    """
+    Called when the LOC crawl fails. Every finished repository and page is already in the journal,
+    so the cache is left alone and the next run resumes from there
+    """
+    print('There was an error while updating the cache. The progress so far is saved in', cache.journal,
+          'and the next run will resume from it.')
 
 def save_and_exit(signum, frame):
     """
-    Save all current data and safely exit the program
+    Safely exit the program. The cache file is left untouched. A LOC crawl that is running stops its workers
+    on the way out (see crawl_stop), and the journal keeps everything finished so far for the next run to resume from
     """
-    filename = 'cache/' + hashlib.sha256(USER_NAME.encode('utf-8')).hexdigest() + '.txt'
-    with open(filename, 'w') as f:
-        f.write('data {} {}\n'.format(time.time(), 0))
     exit(1)
 
-# Set up signal to handle saving data and exiting safely
-signal.signal(signal.SIGINT, save_and_exit)
+def use_profile(username):
+    """
+    Points the per-user module state (USER_NAME, OWNER_ID, and the query and retry counters) at username
+    The HTTP session and the rate limit budget are left alone, so every user in a batch shares them
+    """
+    global USER_NAME, OWNER_ID
+    USER_NAME, OWNER_ID = username, None
+    reset_counters()
+
+def reset_counters():
+    """
+    Zeroes the query and retry counters, so the totals printed by profile_card cover one run
+    """
+    with QUERY_COUNT_LOCK:
+        for funct_id in QUERY_COUNT:
+            QUERY_COUNT[funct_id] = 0
+        for funct_id in RETRY_COUNT:
+            RETRY_COUNT[funct_id] = 0
+            RETRY_TIME[funct_id] = 0.0
+
+def loc_stats(repos, state):
+    """
+    Returns ([additions, deletions, total, cached], my commits) over the repositories in repos, and records them in state
+    Nothing is counted if no repository moved since they were recorded (see fast_path_state), and every repository
+    is counted again from scratch every RECONCILE_DAYS, in case GitHub's figures drifted, and whenever LOC_ENGINE
+    changed, so the total never adds up records counted in two different ways. Until such a full recount finishes,
+    its epoch is the engine and the time of the previous one, so a run that picks it up again resumes from its journal
+    """
+    fingerprint = heads_fingerprint(repos)
+    full_loc = reconcile_due(state, 'loc') or ('loc' in state and state.get('engine', 'graphql') != LOC_ENGINE)
+    epoch = LOC_ENGINE + ' ' + state.get('reconciled', {}).get('loc', '-')
+    if not full_loc and fast_path_state(fingerprint, state) is not None:
+        formatter('LOC (unchanged)', 0)
+        return state['loc'] + [True], state['commits']
+    total_loc, loc_time = perf_counter(cache_builder, repos, 7, full_loc, epoch=epoch)
+    formatter('LOC (cached)', loc_time) if total_loc[-1] else formatter('LOC (no cache)', loc_time)
+    commit_data, commit_time = perf_counter(commit_counter, 7)
+    formatter('commit counter', commit_time)
+    state.update(fingerprint=fingerprint, loc=total_loc[:3], commits=commit_data, engine=LOC_ENGINE)
+    if full_loc or 'loc' not in state.get('reconciled', {}):
+        reconciled(state, 'loc')
+    return total_loc, commit_data
+
+def profile_card(filenames, birthday=None):
+    """
+    Computes every stat of USER_NAME and writes them into each SVG file in filenames
+    The age is counted from birthday, or from the account's creation if it is not given
+    Returns the profile and the repositories it was computed from
+    """
+    global OWNER_ID
+    print('Calculation times:')
+    profile, profile_time = perf_counter(profile_getter, USER_NAME)
+    OWNER_ID = profile.id
+    formatter('account data', profile_time)
+    age_data, age_time = perf_counter(daily_readme, birthday or profile.created_at)
+    formatter('age calculation', age_time)
+    (repos, star_data), listing_time = perf_counter(loc_query, ['OWNER', 'COLLABORATOR', 'ORGANIZATION_MEMBER'])
+    profile = profile._replace(stars=star_data)
+    formatter('repository listing', listing_time)
+    state = state_load()
+    total_loc, commit_data = loc_stats(repos, state)
+    if any(slot_id == 'contributions_data' for filename in filenames for slot_id, _ in svg_compile(filename)[1]):
+        # Only worth a request (and a change to the state file) if a card shows it
+        lifetime_contributions, contributions_time = perf_counter(contributions_delta, profile.created_at, state)
+        profile = profile._replace(lifetime_contributions=lifetime_contributions)
+        formatter('contributions', contributions_time)
+    state_save(state)
+
+    svg_render(filenames, profile, age_data, commit_data, total_loc)
+
+    print('Total GitHub GraphQL API calls:', '{:>3}'.format(sum(QUERY_COUNT.values())))
+    for funct_name, count in QUERY_COUNT.items():
+        print('{:<28}'.format('   ' + funct_name + ':'), '{:>6}'.format(count))
+    if sum(RETRY_COUNT.values()):
+        print('Retried GitHub GraphQL API calls:', '{:>3}'.format(sum(RETRY_COUNT.values())),
+              '({:.1f} s spent waiting)'.format(sum(RETRY_TIME.values())))
+    return profile, repos
 
-def main():
+def repository_getter(owner, repo_name):
+    """
+    Returns one Repository, fetched with the same fields as repository_pages, or None if it is gone
+    """
+    query_count('repository_getter')
+    query = """
+    query ($owner: String!, $repo_name: String!) {""" + RATE_LIMIT_FIELD + """
+        repository(owner: $owner, name: $repo_name) {
+            nameWithOwner
+            owner {
+                login
+            }
+            stargazers {
+                totalCount
+            }
+            defaultBranchRef {
+                target {
+                    ... on Commit {
+                        oid
+                        history {
+                            totalCount
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+    node = simple_request(repository_getter.__name__, query, {'owner': owner, 'repo_name': repo_name})['repository']
+    return None if node is None else Repository.from_node(node)
+
+def refresh_repositories(filenames, names):
+    """
+    Serve mode: brings the repositories in names (owner/name) up to date after a push, and renders the cards again,
+    reusing the profile and the rest of the repository listing kept in memory by the last full refresh
+    """
+    profile, repos = DAEMON['profile'], list(DAEMON['repos'])
+    for name in names:
+        index = next(i for i, repo in enumerate(repos) if repo.name == name)
+        repo = repository_getter(*name.split('/'))
+        if repo is None:
+            del repos[index]
+        else:
+            repos[index] = repo
+    state = state_load()
+    total_loc, commit_data = loc_stats(repos, state)
+    profile = profile._replace(stars=repository_stars(repos, USER_NAME))
+    state_save(state)
+    svg_render(filenames, profile, daily_readme(DAEMON['birthday'] or profile.created_at), commit_data, total_loc)
+    DAEMON['profile'], DAEMON['repos'] = profile, repos
+
+def serve_refresh(filenames):
+    """
+    Serve mode: runs whatever refresh is due (a full one, or only the repositories webhooks asked for),
+    then publishes the rendered cards. A failed refresh is reported and the previous cards are kept
+    Either way its spans are flushed and the counters reset, so neither grows over the life of the daemon
+    """
+    with DAEMON['lock']:
+        names, full = DAEMON['pending'], DAEMON['full'] or DAEMON['repos'] is None
+        DAEMON['pending'], DAEMON['full'] = set(), False
+        DAEMON['wake'].clear()
+    known = {repo.name for repo in DAEMON['repos'] or []}
+    full = full or not names <= known  # A repository not in the listing yet, the listing has to be fetched again
+    try:
+        if full:
+            DAEMON['profile'], DAEMON['repos'] = profile_card(filenames, DAEMON['birthday'])
+        else:
+            refresh_repositories(filenames, sorted(names))
+    except Exception as e:
+        print(f"Refresh failed, still serving the previous cards: {str(e)}")
+        return
+    finally:
+        trace_flush()
+        reset_counters()
+    svgs = {}
+    for filename in filenames:
+        svg = svg_compile(filename)[2]
+        svgs['/' + os.path.basename(filename)] = (svg, '"' + hashlib.sha256(svg).hexdigest()[:32] + '"')
+    with DAEMON['lock']:
+        DAEMON['svgs'] = svgs
+
+def webhook_repository(body, signature):
+    """
+    Returns the repository (owner/name) the body of a GitHub push webhook is about, or None if it names none
+    or is not signed with WEBHOOK_SECRET (its X-Hub-Signature-256). Only called for push events, see do_POST
+    """
+    expected = 'sha256=' + hmac.new(WEBHOOK_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, signature or ''):
+        return None
     try:
-        validate_environment()
+        return json.loads(body)['repository']['full_name']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def serve_cards(filenames, host='127.0.0.1', port=8080, interval=SERVE_INTERVAL, birthday=None):
+    """
+    Serve mode: keeps the cards of USER_NAME up to date in memory, and serves them over HTTP
+    GET /<card>.svg returns a card, with an ETag so unchanged cards cost a 304. POST /webhook takes a GitHub push
+    webhook signed with WEBHOOK_SECRET and refreshes that repository alone within seconds; other events are ignored
+    Everything is refreshed every interval seconds
+    Runs until interrupted
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class CardHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with DAEMON['lock']:
+                card = DAEMON['svgs'].get(self.path.split('?')[0])
+            if card is None:
+                return self.reply(404, b'Not Found\n', 'text/plain')
+            svg, etag = card
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                return self.reply(304, b'', None, etag)
+            self.reply(200, svg, 'image/svg+xml', etag)
+
+        def do_POST(self):
+            if self.path != '/webhook':
+                return self.reply(404, b'Not Found\n', 'text/plain')
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            event = self.headers.get('X-GitHub-Event')
+            if event == 'ping':
+                return self.reply(200, b'pong\n', 'text/plain')
+            if event != 'push':  # Stars, issues, watches... name a repository too, but change none of its lines
+                return self.reply(202, b'Ignored, not a push\n', 'text/plain')
+            if not WEBHOOK_SECRET:
+                return self.reply(403, b'Set WEBHOOK_SECRET to take webhooks\n', 'text/plain')
+            name = webhook_repository(body, self.headers.get('X-Hub-Signature-256'))
+            if name is None:
+                return self.reply(400, b'Bad signature, or no repository\n', 'text/plain')
+            with DAEMON['lock']:
+                DAEMON['pending'].add(name)
+            DAEMON['wake'].set()
+            self.reply(202, b'Accepted\n', 'text/plain')
+
+        def reply(self, status, body, content_type, etag=None):
+            self.send_response(status)
+            if content_type:
+                self.send_header('Content-Type', content_type)
+            if etag:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')  # Cached, but checked against the ETag every time
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    DAEMON['birthday'] = birthday
+    serve_refresh(filenames)
+    server = ThreadingHTTPServer((host, port), CardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {', '.join(DAEMON['svgs'])} on http://{host}:{server.server_address[1]}")
+    next_full = time.monotonic() + interval * random.uniform(1 - SERVE_JITTER, 1 + SERVE_JITTER)
+    while True:
+        DAEMON['wake'].wait(max(0.0, next_full - time.monotonic()))
+        if time.monotonic() >= next_full:
+            with DAEMON['lock']:
+                DAEMON['full'] = True
+            next_full = time.monotonic() + interval * random.uniform(1 - SERVE_JITTER, 1 + SERVE_JITTER)
+        serve_refresh(filenames)
+
+def batch_users(users, users_file):
+    """
+    Returns the logins given as a comma separated list and/or in a file, one per line ('#' starts a comment)
+    """
+    logins = [login.strip() for login in (users or '').split(',')]
+    if users_file:
+        with open(users_file, 'r') as f:
+            logins += [line.split('#')[0].strip() for line in f]
+    logins = list(dict.fromkeys(login for login in logins if login))  # Drop blanks and duplicates, keep the order
+    invalid = [login for login in logins if not validate_github_username(login)]
+    if invalid:
+        raise ValueError(f"Invalid GitHub usernames: {', '.join(invalid)}")
+    return logins
+
+def batch_main(logins, out_dir, templates=('dark_mode.svg', 'light_mode.svg')):
+    """
+    Renders the cards of many users in one process, one after the other, sharing the HTTP session
+    and the rate limit budget. Each user keeps its own cache and counters, and gets its own copy of
+    every template under out_dir/<login>/
+    Returns the logins that failed
+    """
+    failed = []
+    for login in logins:
+        print(f"--- {login} ---")
+        use_profile(login)
+        filenames = []
+        for template in templates:
+            filename = os.path.join(out_dir, login, os.path.basename(template))
+            if not os.path.exists(filename):
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                shutil.copyfile(template, filename)
+            filenames.append(filename)
+        try:
+            profile_card(filenames)
+        except Exception as e:
+            print(f"Failed to render {login}: {str(e)}")
+            failed.append(login)
+    return failed
+
+def startup_report(budget_ms=STARTUP_BUDGET_MS):
+    """
+    Imports this module in a fresh interpreter under python -X importtime, and prints what the import costs
+    against budget_ms, with the slowest of its direct imports first
+    Returns True if the import fits in the budget
+    """
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import today'], cwd=here,
+                            capture_output=True, text=True)
+    imports, children, total = [], [], 0  # (cumulative us, module) of today's direct imports
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # A top level import, listed after everything it imported
+            if name.strip() == 'today':
+                imports, total = children, int(cumulative)
+            children = []
+        elif not name.startswith('    '):
+            children.append((int(cumulative), name.strip()))
+    print('Startup (python -X importtime):')
+    formatter('import today', total / 1e6)
+    for cumulative, name in sorted(imports, reverse=True)[:10]:
+        formatter('  ' + name, cumulative / 1e6)
+    print('Within' if total / 1000 <= budget_ms else 'Over', 'the startup budget of', budget_ms, 'ms')
+    return total / 1000 <= budget_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Renders GitHub profile stats into the SVG cards')
+    parser.add_argument('--users', help='batch mode: comma separated GitHub logins to render, instead of USER_NAME')
+    parser.add_argument('--users-file', help='batch mode: file with one GitHub login per line')
+    parser.add_argument('--out', default='cards', help='batch mode: directory for the per-user SVG files (default: cards)')
+    parser.add_argument('--startup-report', action='store_true', help='print the import time of this module and exit')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='serve mode: keep the cards up to date and serve them on PORT')
+    parser.add_argument('--host', default='127.0.0.1', help='serve mode: address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--interval', type=float, default=SERVE_INTERVAL,
+                        help='serve mode: seconds between full refreshes, give or take 10%% (default: SERVE_INTERVAL or 3600)')
+    parser.add_argument('--trace', help='write a span for every GraphQL request to this file (Chrome trace if it ends in .json, '
+                                        'JSON lines otherwise) and print a latency summary, same as TRACE_FILE')
+    args = parser.parse_args(argv)
+    if args.startup_report:
+        sys.exit(0 if startup_report() else 1)
+    TRACE['file'] = args.trace or TRACE['file']
+    batch = bool(args.users or args.users_file)
+
+    # Set up signal to handle saving data and exiting safely
+    signal.signal(signal.SIGINT, save_and_exit)
+    try:
+        validate_environment(batch)
         ensure_cache_directory()
-        
-        # Your existing main code here
-        
+
+        if batch:
+            failed = batch_main(batch_users(args.users, args.users_file), args.out)
+            if failed:
+                raise Exception(f"Failed to render: {', '.join(failed)}")
+        elif args.serve is not None:
+            serve_cards(['dark_mode.svg', 'light_mode.svg'], args.host, args.serve, args.interval, os.environ.get('BIRTHDAY'))
+        else:
+            profile_card(['dark_mode.svg', 'light_mode.svg'], os.environ.get('BIRTHDAY'))
+
     except ValueError as e:
         print(f"Validation Error: {str(e)}")
         sys.exit(1)
@@ -539,6 +1889,8 @@ def main():
     except Exception as e:
         print(f"Unexpected Error: {str(e)}")
         sys.exit(1)
+    finally:
+        trace_flush()  # Also when the run failed, that is when the trace is most wanted
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()